@@ -0,0 +1,162 @@
+from dotenv import load_dotenv
+from newspaper import Article
+from newspaper.article import ArticleException
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import logging
+import os
+import requests
+import sqlite3
+import threading
+import time
+
+load_dotenv()
+ARTICLE_CACHE_PATH = Path(os.getenv("ARTICLE_CACHE_PATH", "./enh_news_info/cache/article_cache.db"))
+ARTICLE_CACHE_MAX_BYTES = int(os.getenv("ARTICLE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+ARTICLE_CACHE_FRESHNESS = int(os.getenv("ARTICLE_CACHE_FRESHNESS", 60 * 60))
+ARTICLE_FETCH_TIMEOUT = 15
+
+FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+}
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "cmpid"}
+
+logger = logging.getLogger(__name__)
+
+def canonicalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "https"
+    host = parts.hostname.lower() if parts.hostname else ""
+    if parts.port and not (scheme, parts.port) in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not (key.lower().startswith("utm_") or key.lower() in TRACKING_PARAMS)
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+class ArticleCache:
+    """SQLite-backed cache of parsed articles, evicted LRU beyond a total size."""
+
+    def __init__(self, path=ARTICLE_CACHE_PATH, max_bytes=ARTICLE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "url TEXT PRIMARY KEY, title TEXT, text TEXT, etag TEXT, last_modified TEXT, "
+            "fetched REAL, accessed REAL, size INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS articles_accessed ON articles (accessed)")
+        self._conn.commit()
+
+    def lookup(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, text, etag, last_modified, fetched FROM articles WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._conn.execute("UPDATE articles SET accessed = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+
+        title, text, etag, last_modified, fetched = row
+        return {
+            "url": url,
+            "title": title,
+            "text": text,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched": fetched
+        }
+
+    def store(self, url, title, text, etag=None, last_modified=None):
+        now = time.time()
+        size = len(title.encode("utf-8")) + len(text.encode("utf-8"))
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO articles "
+                "(url, title, text, etag, last_modified, fetched, accessed, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, title, text, etag, last_modified, now, now, size)
+            )
+            self._evict()
+            self._conn.commit()
+
+        return self.lookup(url)
+
+    def revalidated(self, url):
+        with self._lock:
+            self._conn.execute("UPDATE articles SET fetched = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+        return self.lookup(url)
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM articles").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for url, size in self._conn.execute("SELECT url, size FROM articles ORDER BY accessed ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM articles WHERE url = ?", (url,))
+            total -= size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_article_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArticleCache()
+        return _cache
+
+def is_fresh(entry):
+    return time.time() - entry["fetched"] < ARTICLE_CACHE_FRESHNESS
+
+def revalidation_headers(entry):
+    headers = dict(FETCH_HEADERS)
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def parse_article(url, html):
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return article.title, article.text
+
+def get_article(news_url):
+    cache = get_article_cache()
+    url = canonicalize_url(news_url)
+    entry = cache.lookup(url)
+
+    if entry and is_fresh(entry):
+        return entry
+
+    try:
+        response = requests.get(news_url, headers=revalidation_headers(entry), timeout=ARTICLE_FETCH_TIMEOUT)
+        if response.status_code == 304 and entry:
+            return cache.revalidated(url)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if entry:
+            logger.warning(f"Revalidation failed for {news_url}, serving cached copy: {e}")
+            return entry
+        raise ArticleException(f"Failed to download article at {news_url}: {e}")
+
+    title, text = parse_article(news_url, response.text)
+    return cache.store(
+        url, title, text,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified")
+    )
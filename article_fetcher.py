@@ -0,0 +1,114 @@
+from article_cache import canonicalize_url, get_article_cache, is_fresh, parse_article, revalidation_headers
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import aiohttp
+import asyncio
+import atexit
+import logging
+import os
+import threading
+
+load_dotenv()
+FETCH_MAX_IN_FLIGHT = int(os.getenv("FETCH_MAX_IN_FLIGHT", 32))
+FETCH_PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", 2))
+FETCH_TIMEOUT = int(os.getenv("FETCH_TIMEOUT", 15))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", 5 * 1024 * 1024))
+FETCH_PARSE_WORKERS = int(os.getenv("FETCH_PARSE_WORKERS", 4))
+FETCH_CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+class ArticleFetcher:
+    """Fetches articles on a background event loop through one keep-alive session."""
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._parse_pool = ThreadPoolExecutor(max_workers=FETCH_PARSE_WORKERS)
+        self._session = None
+        threading.Thread(target=self._loop.run_forever, name="article-fetcher", daemon=True).start()
+
+    def fetch_all(self, urls):
+        future = asyncio.run_coroutine_threadsafe(self._fetch_all(urls), self._loop)
+        return future.result()
+
+    def close(self):
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._parse_pool.shutdown(wait=False)
+
+    async def _fetch_all(self, urls):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=FETCH_MAX_IN_FLIGHT, limit_per_host=FETCH_PER_HOST_LIMIT),
+                # No total budget here: it would also count the wait for a per-host slot, failing queued URLs
+                # before they are sent. Sockets are capped instead, and the body read has its own budget below.
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=FETCH_TIMEOUT, sock_read=FETCH_TIMEOUT)
+            )
+
+        articles = await asyncio.gather(*(self._fetch(url) for url in urls))
+        return dict(zip(urls, articles))
+
+    async def _fetch(self, news_url):
+        cache = get_article_cache()
+        url = canonicalize_url(news_url)
+        entry = cache.lookup(url)
+
+        if entry and is_fresh(entry):
+            return entry
+
+        try:
+            async with self._session.get(news_url, headers=revalidation_headers(entry)) as response:
+                if response.status == 304 and entry:
+                    return cache.revalidated(url)
+                response.raise_for_status()
+
+                body = await asyncio.wait_for(self._read_capped(response, news_url), FETCH_TIMEOUT)
+                html = decode_html(body, response.charset)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if entry:
+                logger.warning(f"Revalidation failed for {news_url}, serving cached copy: {e}")
+                return entry
+            logger.warning(f"Failed to fetch article at {news_url}: {e!r}")
+            return None
+
+        try:
+            title, text = await self._loop.run_in_executor(self._parse_pool, parse_article, news_url, html)
+        except Exception as e:
+            logger.warning(f"Failed to parse article at {news_url}: {e}")
+            return None
+
+        return cache.store(url, title, text, etag=etag, last_modified=last_modified)
+
+    @staticmethod
+    async def _read_capped(response, news_url):
+        if (response.content_length or 0) > FETCH_MAX_BYTES:
+            logger.info(f"Truncating {news_url}: declared size {response.content_length} bytes exceeds cap")
+
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(FETCH_CHUNK_SIZE):
+            body.extend(chunk)
+            if len(body) >= FETCH_MAX_BYTES:
+                logger.info(f"Truncating {news_url} at {FETCH_MAX_BYTES} bytes")
+                del body[FETCH_MAX_BYTES:]
+                break
+        return bytes(body)
+
+def decode_html(body, charset):
+    try:
+        return body.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+def fetch_articles(urls):
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = ArticleFetcher()
+            atexit.register(_fetcher.close)
+    return _fetcher.fetch_all(list(urls))
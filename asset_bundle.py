@@ -0,0 +1,83 @@
+from dotenv import load_dotenv
+from pathlib import Path
+import logging
+import os
+import re
+import requests
+
+load_dotenv()
+ASSET_DIR = Path(os.getenv("RENDER_ASSET_DIR") or Path(__file__).resolve().parent / "assets")
+
+BOOTSTRAP_VERSION = "5.3.3"
+BOOTSTRAP_ICONS_VERSION = "1.11.3"
+
+# (local path, pinned source URL, pattern of external URLs served by the local copy)
+BUNDLED_ASSETS = [
+    (
+        f"bootstrap-{BOOTSTRAP_VERSION}/bootstrap.min.css",
+        f"https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}/dist/css/bootstrap.min.css",
+        r"https?://[^\s\"'()]*/bootstrap(?:\.min)?\.css"
+    ),
+    (
+        f"bootstrap-{BOOTSTRAP_VERSION}/bootstrap.bundle.min.js",
+        f"https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}/dist/js/bootstrap.bundle.min.js",
+        r"https?://[^\s\"'()]*/bootstrap(?:\.bundle)?(?:\.min)?\.js"
+    ),
+    (
+        f"bootstrap-icons-{BOOTSTRAP_ICONS_VERSION}/bootstrap-icons.min.css",
+        f"https://cdn.jsdelivr.net/npm/bootstrap-icons@{BOOTSTRAP_ICONS_VERSION}/font/bootstrap-icons.min.css",
+        r"https?://[^\s\"'()]*/bootstrap-icons(?:\.min)?\.css"
+    ),
+    (
+        f"bootstrap-icons-{BOOTSTRAP_ICONS_VERSION}/fonts/bootstrap-icons.woff2",
+        f"https://cdn.jsdelivr.net/npm/bootstrap-icons@{BOOTSTRAP_ICONS_VERSION}/font/fonts/bootstrap-icons.woff2",
+        None
+    ),
+    (
+        f"bootstrap-icons-{BOOTSTRAP_ICONS_VERSION}/fonts/bootstrap-icons.woff",
+        f"https://cdn.jsdelivr.net/npm/bootstrap-icons@{BOOTSTRAP_ICONS_VERSION}/font/fonts/bootstrap-icons.woff",
+        None
+    )
+]
+
+EXTERNAL_URL_PATTERN = re.compile(r"https?://[^\s\"'()<>]+")
+
+logger = logging.getLogger(__name__)
+
+def rewrite_assets(html_code):
+    def localize(match):
+        url = match.group(0)
+        for local_path, _, pattern in BUNDLED_ASSETS:
+            if pattern and re.fullmatch(pattern, url):
+                local_file = ASSET_DIR / local_path
+                if local_file.exists():
+                    return local_file.as_uri()
+                logger.warning(f"Bundled asset missing: {local_file}")
+        return url
+
+    return EXTERNAL_URL_PATTERN.sub(localize, html_code)
+
+def localize_html(html_path):
+    html_path = Path(html_path.removeprefix("file://"))
+    offline_path = html_path.with_name(f"{html_path.stem}.offline{html_path.suffix}")
+
+    html_code = html_path.read_text(encoding="utf-8")
+    offline_path.write_text(rewrite_assets(html_code), encoding="utf-8")
+    return offline_path.resolve().as_uri()
+
+def download_assets():
+    for local_path, url, _ in BUNDLED_ASSETS:
+        out_path = ASSET_DIR / local_path
+        if out_path.exists():
+            continue
+
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_bytes(response.content)
+        logger.info(f"Downloaded {url} -> {out_path}")
+
+# Bundling------------------------------------------------------
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    download_assets()
@@ -1,11 +1,12 @@
+from article_cache import get_article
 from datetime import datetime
 from dotenv import load_dotenv
 from figure_generator import generate_figure
 from infogen import generate_infographic, modify_infographic
 from io import BytesIO
-from newspaper import Article
 from newspaper import ArticleException
 from pathlib import Path
+from retry_policy import StageFailedError
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 from util import *
 import logging
@@ -53,6 +54,8 @@ STEP_2_MENU = """Please select how you would like to apply suggestions.
     3. Return to the previous step.
 Press the number corresponding to your choice (1-3) : """
 
+SERVICE_ERROR_MESSAGE = "The AI service is not responding right now, so I had to stop early. Please try again in a few minutes."
+
 TARGET_SCORE = 21
 
 bot = telebot.TeleBot(BOT_TOKEN)
@@ -98,9 +101,7 @@ def handle_url(message):
     url = message.text.strip()
 
     try:
-        article = Article(url)
-        article.download()
-        article.parse()
+        get_article(url)
 
         user_data[chat_id]["url"] = url
 
@@ -153,7 +154,10 @@ def handle_info_gen(chat_id):
 
     bot.send_message(chat_id, "Generating infographic...\nthis may take approximately 8 to 10 minutes. Thanks for your patience!")
     
-    info_img, forward_metadata, evaluation = generate_infographic(url, goal, info_dir)
+    try:
+        info_img, forward_metadata, evaluation = generate_infographic(url, goal, info_dir)
+    except StageFailedError as e:
+        return report_stage_failure(chat_id, e, can_resume=False)
     report_msg, suggestions = report_evaluation(evaluation, TARGET_SCORE)
 
     chat_data[chat_id]["forward_metadata"] = forward_metadata
@@ -182,7 +186,11 @@ def handle_info_mod(chat_id):
     info_dir = out_dir / f"gen_pass_{gen_pass:03}"
     info_dir.mkdir(parents=True, exist_ok=True)
     
-    info_img, forward_metadata, evaluation = modify_infographic(forward_metadata, user_feedback, info_dir)
+    try:
+        info_img, forward_metadata, evaluation = modify_infographic(forward_metadata, user_feedback, info_dir)
+    except StageFailedError as e:
+        reset_feedback(user_feedback)
+        return report_stage_failure(chat_id, e, can_resume=True)
     report_msg, suggestions = report_evaluation(evaluation, TARGET_SCORE)
 
     chat_data[chat_id]["forward_metadata"] = forward_metadata
@@ -308,6 +316,20 @@ def callback_inline(call):
             ])
             update_message(call, message, markup)
 
+def report_stage_failure(chat_id, error, can_resume):
+    logger.error(f"Generation failed for chat {chat_id}: {error}")
+
+    if not can_resume:
+        return bot.send_message(chat_id, f"{SERVICE_ERROR_MESSAGE}\nSend /start to begin again.")
+
+    # The previous infographic is still intact, so let the user pick another action
+    message = f"{SERVICE_ERROR_MESSAGE}\nYour previous infographic is unchanged. Are you satisfied with it or do you wish to terminate the session?"
+    markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("yes", callback_data="satisfied"),
+        InlineKeyboardButton("no", callback_data="not-satisfied")]
+    ])
+    bot.send_message(chat_id=chat_id, text=message, reply_markup=markup)
+
 def update_message(call, text, markup=None):
     bot.edit_message_text(
         chat_id=call.message.chat.id,
@@ -369,7 +391,10 @@ def handle_figure_regen(message):
 
     for idx in figure_ids:
         stats = stats_data[idx]
-        img, desc = generate_figure(stats, color_scheme)
+        try:
+            img, desc = generate_figure(stats, color_scheme)
+        except StageFailedError as e:
+            return report_stage_failure(chat_id, e, can_resume=True)
 
         width, height = img.size
         img_specifications = {
@@ -1,18 +1,25 @@
 from datetime import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm_client import create_completion, get_client
+from model_router import run_routed
+from output_parser import parse_output
 from PIL import Image
+from prompt_builder import build_prompt
 from util import encode_img, report_evaluation
-import ast
 import logging
+import numpy as np
 import openai
 import os
-import re
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
 logger = logging.getLogger(__name__)
 
+EVAL_IMAGE_MAX_EDGE = int(os.getenv("EVAL_IMAGE_MAX_EDGE", 2048))
+EVAL_IMAGE_FORMAT = os.getenv("EVAL_IMAGE_FORMAT", "JPEG")
+EVAL_IMAGE_QUALITY = int(os.getenv("EVAL_IMAGE_QUALITY", 85))
+EVAL_IMAGE_GRAYSCALE = os.getenv("EVAL_IMAGE_GRAYSCALE", "false").lower() == "true"
+
 EVALUATION_USER_PROMPT = """
 Your task is to rigorously evaluate the provided infographic image using the quantitative metrics and scoring algorithms described below. Base your assessment on visual analysis principles and simulate relevant calculations to justify your scoring.
 
@@ -87,12 +94,49 @@ You are an expert at infographic image analysis and evaluation. Your task is to
 The output must be a Python dictionary, delimited with triple backticks, and should not include any additional text, Markdown formatting, or escape characters.
 """
 
-def evaluate(infographic_img):
-    utf8_img = encode_img(infographic_img)
+SUGGESTION_USER_PROMPT = """
+Your task is to provide constructive suggestions for improving the provided infographic image.
+
+Instructions:
+- Focus on the metrics scoring below 9, using their calculations to locate the problems in the image.
+- Suggestions must be actionable within design constraints: the visual figures themselves are fixed and cannot be altered. Improvements must come from regenerating layout or adding contextual elements.
+- Suggestions may also address visual appeal of infographic, such as color adjustments.
+
+Output only the following in valid Python list format:
+[
+    "suggestion 1",
+    "suggestion 2",
+    ...
+]
+
+The layout has already been measured from the rendered element bounding boxes:
+{metrics}
+"""
+
+SUGGESTION_SYSTEM_PROMPT = """
+You are an expert at infographic image analysis and evaluation. Your task is to provide constructive feedback on the infographic based on the given design measurements.
+
+The output must be a Python list, delimited with triple backticks, and should not include any additional text, Markdown formatting, or escape characters.
+"""
+
+IOU_TOLERANCE = 0.02
+ALIGNMENT_TOLERANCE = 0.05
+SPACING_TOLERANCE = 1.0
+SUGGESTION_SCORE = 9
+
+def evaluate(infographic_img, geometry=None):
+    if geometry is not None:
+        evaluation = evaluate_geometry(geometry)
+        if any(evaluation[metric]["score"] < SUGGESTION_SCORE for metric in ("overlap", "alignment", "spacing")):
+            evaluation["suggestions"] = suggest_improvements(infographic_img, evaluation)
+        return evaluation
+
+    utf8_img = encode_eval_img(infographic_img)
 
-    while True:
-        completion = client.chat.completions.create(
-            model='gpt-4o',
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "evaluate", refresh=refresh,
+            model=model,
             messages=[
                 {"role": "system", "content": EVALUATION_SYSTEM_PROMPT},
                 {
@@ -107,13 +151,147 @@ def evaluate(infographic_img):
             top_p=0.9
         )
 
-        try: 
-            response = completion.choices[0].message.content.strip()
-            evaluation = ast.literal_eval(re.sub(r"^```(python|json)?|```$", "", response).strip())
-            return evaluation
-        except (SyntaxError, ValueError) as e:
-            logger.warning(f"Error parsing response: {e}")
-            logger.info("Retrying...")
+        response = completion.choices[0].message.content.strip()
+        return parse_output(response, "evaluate", expected=dict, required_keys=("overlap", "alignment", "spacing"))
+
+    return run_routed("evaluate", attempt)
+
+def encode_eval_img(infographic_img):
+    utf8_img = encode_img(
+        infographic_img,
+        max_edge=EVAL_IMAGE_MAX_EDGE,
+        img_format=EVAL_IMAGE_FORMAT,
+        quality=EVAL_IMAGE_QUALITY,
+        grayscale=EVAL_IMAGE_GRAYSCALE
+    )
+    logger.info(f"Evaluation image payload: {len(utf8_img)} bytes ({EVAL_IMAGE_FORMAT}, source {infographic_img.size[0]}x{infographic_img.size[1]})")
+    return utf8_img
+
+def evaluate_geometry(geometry):
+    elements = geometry["elements"]
+    page_width = max(geometry["width"], 1)
+    page_height = max(geometry["height"], 1)
+
+    boxes = np.array(
+        [[e["x"], e["y"], e["x"] + e["width"], e["y"] + e["height"]] for e in elements],
+        dtype=float
+    ).reshape(-1, 4)
+    num_elements = len(boxes)
+
+    if num_elements < 2:
+        calculation = f"{num_elements} element(s) rendered, no pairs to compare."
+        return {
+            "overlap": {"score": 10, "calculation": calculation},
+            "alignment": {"score": 10, "calculation": calculation},
+            "spacing": {"score": 10, "calculation": calculation},
+            "suggestions": []
+        }
+
+    mean_iou, overlapping_pairs = compute_overlap(boxes)
+    mean_deviation, num_aligned = compute_alignment(boxes, page_width, page_height)
+    gap_variance, gap_cv, num_gaps = compute_spacing(boxes)
+
+    num_pairs = num_elements * (num_elements - 1) // 2
+    return {
+        "overlap": {
+            "score": scale_score(mean_iou, IOU_TOLERANCE),
+            "calculation": f"Mean IoU {mean_iou:.4f} over {num_pairs} pairs of {num_elements} elements, {overlapping_pairs} pairs overlapping."
+        },
+        "alignment": {
+            "score": scale_score(mean_deviation, ALIGNMENT_TOLERANCE),
+            "calculation": f"Mean deviation of {num_aligned} element edges or centers from the nearest line shared with a column or row sibling is {mean_deviation:.2%} of page size."
+        },
+        "spacing": {
+            "score": scale_score(gap_cv, SPACING_TOLERANCE),
+            "calculation": f"Variance of {num_gaps} neighbour gaps is {gap_variance:.1f} px^2 (coefficient of variation {gap_cv:.2f})."
+        },
+        "suggestions": []
+    }
+
+def compute_overlap(boxes):
+    left = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    top = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    right = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    bottom = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area[:, None] + area[None, :] - intersection
+    iou = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    pairs = iou[np.triu_indices(len(boxes), k=1)]
+    return float(pairs.mean()), int(np.count_nonzero(pairs))
+
+def compute_alignment(boxes, page_width, page_height):
+    """Mean distance from each element's edges or centre to the nearest matching line of its siblings.
+
+    Elements whose spans overlap on an axis (stacked in a column, or side by side in a row) are expected
+    to share a line on that axis; an element with no siblings on an axis is not measured there.
+    """
+    deviations = []
+    for axis, page_size in ((0, page_width), (1, page_height)):
+        start, end = boxes[:, axis], boxes[:, axis + 2]
+        anchors = np.stack([start, (start + end) / 2, end], axis=1)
+
+        siblings = np.minimum(end[:, None], end[None, :]) - np.maximum(start[:, None], start[None, :]) > 0
+        np.fill_diagonal(siblings, False)
+
+        distance = np.abs(anchors[:, None, :] - anchors[None, :, :]).min(axis=2)
+        nearest = np.where(siblings, distance, np.inf).min(axis=1)
+        deviations.append(nearest[np.isfinite(nearest)] / page_size)
+
+    deviations = np.concatenate(deviations)
+    if len(deviations) == 0:
+        return 0.0, 0
+    return float(deviations.mean()), len(deviations)
+
+def compute_spacing(boxes):
+    gaps = []
+    for axis in (0, 1):
+        cross = 1 - axis
+        overlap = (
+            np.minimum(boxes[:, None, cross + 2], boxes[None, :, cross + 2])
+            - np.maximum(boxes[:, None, cross], boxes[None, :, cross])
+        )
+        gap = boxes[None, :, axis] - boxes[:, None, axis + 2]
+        gap = np.where((overlap > 0) & (gap >= 0), gap, np.inf)
+        nearest = gap.min(axis=1)
+        gaps.append(nearest[np.isfinite(nearest)])
+
+    gaps = np.concatenate(gaps)
+    if len(gaps) < 2 or gaps.mean() == 0:
+        return 0.0, 0.0, len(gaps)
+    return float(gaps.var()), float(gaps.std() / gaps.mean()), len(gaps)
+
+def scale_score(value, tolerance):
+    return int(round(10 - 9 * min(1.0, value / tolerance)))
+
+def suggest_improvements(infographic_img, evaluation):
+    utf8_img = encode_eval_img(infographic_img)
+    metrics = {metric: evaluation[metric] for metric in ("overlap", "alignment", "spacing")}
+
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "suggestions", refresh=refresh,
+            model=model,
+            messages=[
+                {"role": "system", "content": SUGGESTION_SYSTEM_PROMPT},
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": build_prompt("suggestions", SUGGESTION_USER_PROMPT, dict(metrics=metrics))},
+                        {"type": "image_url", "image_url": {"url": utf8_img}}
+                    ],
+                }
+            ],
+            temperature=0.8,
+            top_p=0.9
+        )
+
+        response = completion.choices[0].message.content.strip()
+        return parse_output(response, "suggestions", expected=list)
+
+    return run_routed("suggestions", attempt)
 
 # Testing-------------------------------------------------------
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+from collections import defaultdict
+import numpy as np
+import re
+import zlib
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+DUPLICATE_THRESHOLD = 0.7
+MERSENNE_PRIME = (1 << 31) - 1
+
+_rng = np.random.default_rng(seed=7)
+PERMUTATION_A = _rng.integers(1, MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _rng.integers(0, MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+def normalize_fact(fact):
+    return " ".join(re.findall(r"[a-z0-9%$.]+", str(fact).lower()))
+
+def char_shingles(text, size=SHINGLE_SIZE):
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def minhash(shingles):
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) & MERSENNE_PRIME for s in shingles], dtype=np.uint64)
+    permuted = (PERMUTATION_A[:, None] * hashes[None, :] + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+class FactIndex:
+    """MinHash/LSH index that collapses near-duplicate facts and counts their sources."""
+
+    def __init__(self, match_numbers=False):
+        self.match_numbers = match_numbers
+        self._entries = []
+        self._buckets = defaultdict(list)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, fact, sources=(), count=1):
+        text = normalize_fact(fact)
+        shingles = char_shingles(text)
+        numbers = set(re.findall(r"\d+(?:[.,]\d+)*", text)) if self.match_numbers else None
+
+        signature = minhash(shingles)
+        band_keys = [
+            (band, signature[band::LSH_BANDS].tobytes())
+            for band in range(LSH_BANDS)
+        ]
+
+        candidates = {idx for key in band_keys for idx in self._buckets.get(key, ())}
+        for idx in sorted(candidates):
+            entry = self._entries[idx]
+            if numbers is not None and numbers != entry["numbers"]:
+                continue
+            if len(shingles & entry["shingles"]) / len(shingles | entry["shingles"]) >= DUPLICATE_THRESHOLD:
+                entry["count"] += count
+                entry["sources"].extend(s for s in sources if s not in entry["sources"])
+                return False
+
+        self._entries.append({
+            "fact": fact,
+            "shingles": shingles,
+            "numbers": numbers,
+            "count": count,
+            "sources": list(dict.fromkeys(sources))
+        })
+        for key in band_keys:
+            self._buckets[key].append(len(self._entries) - 1)
+        return True
+
+    def facts(self):
+        return [entry["fact"] for entry in self._entries]
+
+    def provenance(self):
+        return [{"count": entry["count"], "sources": entry["sources"]} for entry in self._entries]
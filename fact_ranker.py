@@ -0,0 +1,65 @@
+from collections import Counter
+from dotenv import load_dotenv
+from prompt_builder import count_tokens
+from query_frontier import tokenize
+import logging
+import math
+import numpy as np
+import os
+
+load_dotenv()
+REFINEMENT_TOP_K = int(os.getenv("REFINEMENT_TOP_K", 40))
+REFINEMENT_MIN_SCORE = float(os.getenv("REFINEMENT_MIN_SCORE", 0.0))
+REFINEMENT_TOKEN_BUDGET = int(os.getenv("REFINEMENT_TOKEN_BUDGET", 3000))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+PROVENANCE_WEIGHT = 0.2
+
+logger = logging.getLogger(__name__)
+
+def bm25_scores(documents, query):
+    doc_tokens = [tokenize(str(doc)) for doc in documents]
+    query_terms = set(tokenize(query))
+    if not doc_tokens or not query_terms:
+        return np.zeros(len(doc_tokens))
+
+    lengths = np.array([len(tokens) for tokens in doc_tokens], dtype=float)
+    avg_length = max(lengths.mean(), 1.0)
+    doc_freq = Counter(term for tokens in doc_tokens for term in set(tokens) if term in query_terms)
+
+    scores = np.zeros(len(doc_tokens))
+    for term in query_terms:
+        if term not in doc_freq:
+            continue
+        idf = math.log(1 + (len(doc_tokens) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+        term_freq = np.array([tokens.count(term) for tokens in doc_tokens], dtype=float)
+        scores += idf * term_freq * (BM25_K1 + 1) / (
+            term_freq + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+        )
+    return scores
+
+def rank_facts(
+    facts, query, provenance=None, top_k=REFINEMENT_TOP_K,
+    min_score=REFINEMENT_MIN_SCORE, token_budget=REFINEMENT_TOKEN_BUDGET
+    ):
+    scores = bm25_scores(facts, query)
+    if provenance and len(provenance) == len(facts):
+        counts = np.array([source["count"] for source in provenance], dtype=float)
+        scores *= 1 + PROVENANCE_WEIGHT * np.log(np.maximum(counts, 1))
+
+    selected = []
+    used_tokens = 0
+    for idx in np.argsort(-scores, kind="stable"):
+        if len(selected) >= top_k or scores[idx] < min_score:
+            break
+
+        fact_tokens = count_tokens(str(facts[idx]))
+        if selected and used_tokens + fact_tokens > token_budget:
+            break
+
+        selected.append(facts[idx])
+        used_tokens += fact_tokens
+
+    logger.info(f"Selected {len(selected)} of {len(facts)} facts ({used_tokens} tokens) for refinement")
+    return selected
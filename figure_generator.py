@@ -1,22 +1,25 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm_client import create_completion, get_client
+from model_router import run_routed
 from PIL import Image
+from prompt_builder import build_prompt
+from retry_policy import StageFailedError
+from token_ledger import submit_in_context
 import io
 import json
 import logging
 import matplotlib
 matplotlib.use("Agg") 
 import matplotlib.pyplot as plt
-import openai
 import os
 import seaborn as sns
 import re
 import warnings
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
 logger = logging.getLogger(__name__)
 
 EMPTY_IMAGE = Image.new("RGB", (1, 1), (0, 0, 0))
@@ -27,13 +30,18 @@ def generate_figures(stats_data, color_scheme):
 
     with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
         futures = {
-            executor.submit(generate_figure, stats, color_scheme): stats
+            submit_in_context(executor, generate_figure, stats, color_scheme): stats
             for stats in stats_data
         }
 
         for future in as_completed(futures):
             stats = futures[future]
-            img, desc = future.result()
+            try:
+                img, desc = future.result()
+            except StageFailedError as e:
+                # One missing figure should not cost the whole infographic
+                logger.warning(f"Skipping figure: {e}")
+                img, desc = EMPTY_IMAGE, ""
             if img == EMPTY_IMAGE:
                 continue
 
@@ -48,10 +56,6 @@ def generate_figures(stats_data, color_scheme):
 
 FIGURE_PROMPT = """
 Your task is to analyze the given statistical data and generate appropriate Python code to visualize them, strictly following the given color scheme.
-    
-Here is the given information:
-- Statistical Data: {stats}
-- Color Scheme: {color}
 
 Instructions:
 1. Import all necessary modules.
@@ -71,6 +75,10 @@ Instructions:
 10. If the provided data is insufficient for a meaningful visualization, apply appropriate enhancement techniques such as interpolation, smoothing, or data augmentation to improve the plot's appearance.
 11. Provide a concise, one-sentence description of the expected figure, delimited with `|` at the end.
 12. If the statistical data is unsuitable for visualization, return only the phrase: `UNPLOTTABLE_DATA`
+
+Here is the given information:
+- Color Scheme: {color}
+- Statistical Data: {stats}
 """
 
 FIGURE_SYSTEM_PROMPT = """You are an expert at data visualization. Your task is to generate python code to visualize the statistical data as per the given instructions.
@@ -80,11 +88,12 @@ The outputted Python code must be delimited with triple backticks, and should no
 
 def generate_figure(stats, color_scheme):
     
-    user_prompt = FIGURE_PROMPT.format(stats=stats, color=color_scheme)
+    user_prompt = build_prompt("figure", FIGURE_PROMPT, dict(stats=stats, color=color_scheme), strategies={"stats": "dict"})
 
-    while True:
-        completion = client.chat.completions.create(
-            model='o3-mini',
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "figure", refresh=refresh,
+            model=model,
             messages=[
                 {"role": "system", "content": FIGURE_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
@@ -105,24 +114,25 @@ def generate_figure(stats, color_scheme):
             exec_vars = {}
             exec(vis_code, exec_vars)
             fig = exec_vars.get("fig")
+            if fig is None:
+                raise ValueError("Generated code did not define `fig`")
 
-            if fig is not None:
-                fig.tight_layout()
+            fig.tight_layout()
 
-                with io.BytesIO() as buffer:
-                    fig.savefig(buffer, bbox_inches='tight')
-                    buffer.seek(0)
-                    img = Image.open(buffer)
-                    img = img.copy()
+            with io.BytesIO() as buffer:
+                fig.savefig(buffer, bbox_inches='tight')
+                buffer.seek(0)
+                img = Image.open(buffer)
+                img = img.copy()
 
-                plt.close(fig)
-                return img, desc
-        except Exception as e:
-            logger.warning(f"Encountered execution error: {e}")
-            logger.info("Retrying...")
+            plt.close(fig)
+            return img, desc
         finally:
             warnings.filterwarnings("default")
 
+    # Generated code can fail in arbitrary ways, so any execution error earns another attempt
+    return run_routed("figure", attempt, retry_on=(Exception,))
+
 # Testing-------------------------------------------------------
 if __name__ == "__main__":
     with open("./enh_news_info/test/test_refined_data.txt", "r") as f:
@@ -1,10 +1,12 @@
 from datetime import datetime
 from dotenv import load_dotenv
 from layout_rules import GraphLayoutRules
+from llm_client import create_completion, get_client
 from io import BytesIO
-from openai import OpenAI
+from model_router import run_routed
+from output_parser import parse_output
 from PIL import Image
-import ast
+from prompt_builder import build_prompt
 import io
 import json
 import logging
@@ -12,13 +14,10 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import networkx as nx
-import openai
-import os
 import pygraphviz
-import re
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
 logger = logging.getLogger(__name__)
 
 DEFAULT_LAYOUT_PARAMS = {
@@ -50,16 +49,16 @@ Instructions:
     - Node colors: Select an appropriate color from the provided palette that aligns with the graph's data, overall theme, and categories represented by the nodes. Ensure the color enhances visual impact and clarity.
     - Edge colors: Select a color from the provided palette that complements well with the node colors, maintaining clear visibility and readability. Ensure the chosen color harmonize with the graph's data and overall theme.
 
-Here is the given information:
-- Graph Data: {graph}
-- Color Palette: {color}
-
 Output only the following in valid python dictionary format:
 {{
     "layout": "chosen_graphviz_layout",
     "node_color": "hex_code",
     "edge_color": "hex_code"
 }}
+
+Here is the given information:
+- Graph Data: {graph}
+- Color Palette: {color}
 """
 
 GRAPH_SYSTEM_PROMPT = """
@@ -70,11 +69,12 @@ The output must be a Python dictionary, delimited with triple backticks, and sho
 
 def generate_graph_layout(graph_data, color_scheme):
     
-    user_prompt = GRAPH_PROMPT.format(graph=graph_data, color=color_scheme)
+    user_prompt = build_prompt("graph_layout", GRAPH_PROMPT, dict(graph=graph_data, color=color_scheme), strategies={"graph": "dict"})
 
-    while True:
-        completion = client.chat.completions.create(
-            model='gpt-4o-mini',
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "graph_layout", refresh=refresh,
+            model=model,
             messages=[
                 {"role": "system", "content": GRAPH_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
@@ -82,14 +82,10 @@ def generate_graph_layout(graph_data, color_scheme):
             top_p=0.8
         )
 
-        try:
-            response = completion.choices[0].message.content.strip()
-            layout = ast.literal_eval(re.sub(r"^```(python|json)?|```$", "", response).strip())
-            break
-        except (SyntaxError, ValueError) as e:
-            logger.warning(f"Encountered error parsing graph layout: {e}")
-            logger.info("Retrying...")
-    
+        response = completion.choices[0].message.content.strip()
+        return parse_output(response, "graph_layout", expected=dict, required_keys=("layout", "node_color", "edge_color"))
+
+    layout = run_routed("graph_layout", attempt)
     layout["font_color"] = color_scheme["primary"]["text"]
     layout["background"] = color_scheme["primary"]["background"]
     return layout
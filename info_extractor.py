@@ -1,16 +1,22 @@
+from article_cache import get_article
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from newspaper import Article
+from fact_index import FactIndex
+from llm_client import create_completion, get_client
+from model_router import run_routed
 from newspaper.article import ArticleException
-from openai import OpenAI
-import ast
+from output_parser import parse_output
+from prompt_builder import build_prompt, chunk_text
+from query_frontier import normalize_query
+from token_ledger import submit_in_context
 import json
 import logging
 import os
-import openai
-import re
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
+EXTRACTION_CHUNK_TOKENS = int(os.getenv("EXTRACTION_CHUNK_TOKENS", 3000))
+EXTRACTION_CHUNK_WORKERS = int(os.getenv("EXTRACTION_CHUNK_WORKERS", 4))
 
 EMPTY_EXTRACTED_INFO = {
     "title": "",
@@ -21,13 +27,14 @@ EMPTY_EXTRACTED_INFO = {
     "key_entities": [],
     "additional_queries": []
 }
+# Citation extractions run with a topic and are not asked for a title
+EXTRACTION_KEYS = tuple(EMPTY_EXTRACTED_INFO)
+RELEVANT_EXTRACTION_KEYS = EXTRACTION_KEYS[1:]
 
 logger = logging.getLogger(__name__)
 
 EXTRACTION_PROMPT = """Your task is to refine the information extracted from a news article.
 
-The goal of the extraction is as follows: {goal}
-
 Instructions:
 1. Transform the news title into an infographic-style title that is a single, concise sentence without colons (:), subtitles, or introductory phrases. Ensure it retains the core message of the original text.
 2. Read through the entire article text carefully and extract key facts.
@@ -40,10 +47,6 @@ Instructions:
     - Compare the main topic with other related topics to provide a broader understanding.
     - Explore how the main topic relates to global trends.
 
-Here is the extracted information:
-- Article Title: {title}
-- Article Text: {text}
-
 Output only the following in valid python dictionary format:
 {{
     "title": "..."
@@ -54,12 +57,15 @@ Output only the following in valid python dictionary format:
     "key_entities": ["Entity 1", "Entity 2", ...],
     "additional_queries": ["Query 1", "Query 2", ...]
 }}
+
+Here is the extracted information:
+- Goal: {goal}
+- Article Title: {title}
+- Article Text: {text}
 """
 
 RELEVANT_EXTRACTION_PROMPT = """Your task is to extract relevant information from a news article with reference to a topic.
 
-The goal of the extraction is as follows: {goal}
-
 Instructions:
 1. Understand the content of the topic
     - Based on this topic, analyze the provided text and extract relevant facts, key entities, and additional insights.
@@ -73,10 +79,6 @@ Instructions:
     - Compare the main topic with other related topics to provide a broader understanding.
     - Explore how the main topic relates to global trends.
 
-Here is the provided information:
-- Main Topic: {topic}
-- Article Text: {text}
-
 Output only the following in valid python dictionary format:
 {{
     "key_facts": {{
@@ -86,6 +88,11 @@ Output only the following in valid python dictionary format:
     "key_entities": ["Entity 1", "Entity 2", ...],
     "additional_queries": ["Query 1", "Query 2", ...]
 }}
+
+Here is the provided information:
+- Goal: {goal}
+- Main Topic: {topic}
+- Article Text: {text}
 """
 
 SYSTEM_PROMPT = """You are an expert in data extraction. Your task is to carefully analyze the provided news article and extract information as per the given instructions.
@@ -94,26 +101,56 @@ The output must be a Python dictionary, delimited with triple backticks, and sho
 """
 
 def extract_info(news_url, user_goal, topic=None):
-    article = Article(news_url)
+    return extract_article(load_article(news_url), user_goal, topic)
 
+def load_article(news_url):
     try:
-        article.download()
-        article.parse()
+        return get_article(news_url)
     except ArticleException as e:
         logger.error(f"ArticleException: Failed to process article at {news_url}")
-        return EMPTY_EXTRACTED_INFO
     except Exception as e:
         logger.error(f"Unexpected error processing article at {news_url}")
+    return None
+
+def extract_article(article, user_goal, topic=None):
+    if article is None:
         return EMPTY_EXTRACTED_INFO
 
+    news_url = article["url"]
+    chunks = chunk_text(article["text"], EXTRACTION_CHUNK_TOKENS) or [article["text"]]
+    if len(chunks) == 1:
+        return extract_chunk(article["title"], article["text"], user_goal, topic)
+
+    logger.info(f"Extracting {news_url} in {len(chunks)} chunks")
+    with ThreadPoolExecutor(max_workers=min(EXTRACTION_CHUNK_WORKERS, len(chunks))) as executor:
+        futures = [
+            submit_in_context(
+                executor, extract_chunk, article["title"],
+                f"[Part {idx + 1} of {len(chunks)}]\n{chunk}", user_goal, topic
+            )
+            for idx, chunk in enumerate(chunks)
+        ]
+        extracted = [future.result() for future in futures]
+
+    return merge_extracted_info(extracted)
+
+def extract_chunk(title, text, user_goal, topic=None):
+    required_keys = RELEVANT_EXTRACTION_KEYS if topic else EXTRACTION_KEYS
     if topic:
-        user_prompt = RELEVANT_EXTRACTION_PROMPT.format(goal=user_goal, topic=topic, text=article.text)
+        user_prompt = build_prompt(
+            "extract_info", RELEVANT_EXTRACTION_PROMPT,
+            dict(goal=user_goal, topic=topic, text=text), strategies={"text": "text"}
+        )
     else:
-        user_prompt = EXTRACTION_PROMPT.format(goal=user_goal, title=article.title, text=article.text)
+        user_prompt = build_prompt(
+            "extract_info", EXTRACTION_PROMPT,
+            dict(goal=user_goal, title=title, text=text), strategies={"text": "text"}
+        )
 
-    while True:
-        completion = client.chat.completions.create(
-            model="gpt-4o",
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "extract_info", refresh=refresh,
+            model=model,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
@@ -123,15 +160,55 @@ def extract_info(news_url, user_goal, topic=None):
             presence_penalty=1.5
         )
 
-        try: 
-            response = completion.choices[0].message.content.strip()
-            return ast.literal_eval(re.sub(r"^```(python|json)?|```$", "", response).strip())
-        except (SyntaxError, ValueError) as e:
-            logger.warning(f"Encountered error parsing response: {e}")
-            logger.info("Retrying...")
+        response = completion.choices[0].message.content.strip()
+        return parse_output(response, "extract_info", expected=dict, required_keys=required_keys)
+
+    return run_routed("extract_info", attempt)
+
+def merge_extracted_info(extracted):
+    """Merges per-chunk extractions, taking the title from the first chunk and collapsing duplicates."""
+    stats_index = FactIndex(match_numbers=True)
+    facts_index = FactIndex()
+    entities = {}
+    queries = {}
+
+    for info in extracted:
+        key_facts = info.get("key_facts", {})
+        for fact in key_facts.get("statistical", []):
+            stats_index.add(fact)
+        for fact in key_facts.get("non_statistical", []):
+            facts_index.add(fact)
+        for entity in info.get("key_entities", []):
+            entities.setdefault(str(entity).strip().lower(), entity)
+        for query in info.get("additional_queries", []):
+            queries.setdefault(normalize_query(query), query)
+
+    merged = {
+        "key_facts": {
+            "statistical": stats_index.facts(),
+            "non_statistical": facts_index.facts()
+        },
+        "key_entities": list(entities.values()),
+        "additional_queries": list(queries.values())
+    }
+    if "title" in extracted[0]:
+        merged = {"title": extracted[0]["title"], **merged}
+    return merged
 
 # Testing-------------------------------------------------------
 if __name__ == "__main__":
+    topic_answer = """{
+        "key_facts": {"statistical": ["Batam's farm will generate 2.2 GWp"], "non_statistical": []},
+        "key_entities": ["Batam"],
+        "additional_queries": []
+    }"""
+    assert parse_output(topic_answer, "test", expected=dict, required_keys=RELEVANT_EXTRACTION_KEYS)["key_entities"] == ["Batam"]
+    try:
+        parse_output(topic_answer, "test", expected=dict, required_keys=EXTRACTION_KEYS)
+        raise AssertionError("seed extraction without a title should be rejected")
+    except ValueError:
+        pass
+
     news_url = "https://www.channelnewsasia.com/commentary/singapore-indonesia-floating-solar-farm-batam-clean-energy-electricity-4737861"
     goal = "Compare energy generation efficiency of floating solar to other forms of renewable energy used in Singapore."
 
@@ -1,14 +1,14 @@
 from dotenv import load_dotenv
-from openai import OpenAI
-import ast
+from fact_ranker import rank_facts
+from llm_client import create_completion, get_client
+from model_router import primary_model, run_routed
+from output_parser import parse_output
+from prompt_builder import build_prompt
 import json
 import logging
-import openai
-import os
-import re
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
 logger = logging.getLogger(__name__)
 
 REFINEMENT_PROMPT = """
@@ -45,12 +45,6 @@ Instructions:
     - Retain key qualitative facts that add depth, context, or narrative.
     - Combine related facts into meaningful summaries where appropriate to improve clarity and remove redundancy.
 
-Here is the given information:
-- Goal: {goal}
-- Title: {title}
-- Key Statistical Facts: {stats}
-- Key Non-Statistical Facts: {facts}
-
 Output only the following in valid python dictionary format:
 {{
     "key_facts": {{
@@ -62,6 +56,12 @@ Output only the following in valid python dictionary format:
         "non_statistical": ["Refined fact 1", "Refined fact 2", ...]
     }}
 }}
+
+Here is the given information:
+- Goal: {goal}
+- Title: {title}
+- Key Statistical Facts: {stats}
+- Key Non-Statistical Facts: {facts}
 """
 
 REFINEMENT_SYSTEM_PROMPT = """You are an expert at analyzing and generating insightful, relevant, and structured data. Your task is to analyze and refine the statistical and non-statistical facts as per the given instructions. 
@@ -88,17 +88,25 @@ The output must be a Python dictionary, delimited with triple backticks. There s
 """
 
 def manage_info(retrieved_info, user_goal):
+    refined_data = refine_facts(retrieved_info, user_goal)
+    graph_data = generate_graph_data(retrieved_info["title"], retrieved_info["key_entities"], user_goal)
+    return finalize_refined_data(refined_data, graph_data)
 
-    user_prompt = REFINEMENT_PROMPT.format(
+def refine_facts(retrieved_info, user_goal):
+    query = f"{retrieved_info['title']} {user_goal}"
+    provenance = retrieved_info.get("fact_provenance", {})
+
+    user_prompt = build_prompt("refine_facts", REFINEMENT_PROMPT, dict(
         goal=user_goal,
         title=retrieved_info["title"],
-        stats=retrieved_info["key_facts"]["statistical"],
-        facts=retrieved_info["key_facts"]["non_statistical"]
-    )
-
-    while True:
-        completion = client.chat.completions.create(
-            model="gpt-4.5-preview",
+        stats=rank_facts(retrieved_info["key_facts"]["statistical"], query, provenance.get("statistical")),
+        facts=rank_facts(retrieved_info["key_facts"]["non_statistical"], query, provenance.get("non_statistical"))
+    ), strategies={"facts": "list", "stats": "list"})
+
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "refine_facts", refresh=refresh,
+            model=model,
             messages=[
                 {"role": "system", "content": REFINEMENT_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
@@ -109,9 +117,14 @@ def manage_info(retrieved_info, user_goal):
         )
 
         dirty_output = completion.choices[0].message.content.strip()
-
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
+        try:
+            return parse_output(dirty_output, "refine_facts", expected=dict, required_keys=("key_facts",))
+        except ValueError:
+            logger.info("Local repair failed, running structure check...")
+
+        completion = create_completion(
+            client, "structure_check", refresh=refresh,
+            model=primary_model("structure_check"),
             messages=[
                 {"role": "system", "content": STRUCTURE_CHECK_SYSTEM_PROMPT},
                 {"role": "user", "content": STRUCTURE_CHECK_USER_PROMPT},
@@ -121,18 +134,15 @@ def manage_info(retrieved_info, user_goal):
             top_p=0.5
         )
 
-        try: 
-            response = completion.choices[0].message.content.strip()
-            refined_data = ast.literal_eval(re.sub(r"^```(python|json)?|```$", "", response).strip())
-            break
-        except (SyntaxError, ValueError) as e:
-            logger.warning(f"Encountered error parsing response: {e}")
-            logger.info("Retrying...")
-    
+        response = completion.choices[0].message.content.strip()
+        return parse_output(response, "structure_check", expected=dict, required_keys=("key_facts",))
+
+    refined_data = run_routed("refine_facts", attempt)
     refined_data["title"] = retrieved_info["title"]
-    
-    graph_data = generate_graph_data(retrieved_info["title"], retrieved_info["key_entities"], user_goal)
-    
+    return refined_data
+
+def finalize_refined_data(refined_data, graph_data):
+    refined_data = dict(refined_data)
     refined_data["graph"] = graph_data
 
     color_scheme = generate_color_scheme(refined_data)
@@ -151,11 +161,6 @@ Instructions:
 2. Create relation edges between related entities, specifying the relationship between them.
     - Keep relationship descriptions brief, with a maximum of 4 words.
 
-Here is the given Information:
-- Goal: {goal}
-- Title: {title}
-- Key Entities: {key_entities}
-
 Output only the following in valid python dictionary format:
 {{
     "nodes": [
@@ -171,6 +176,11 @@ Output only the following in valid python dictionary format:
         ...
     ]
 }}
+
+Here is the given Information:
+- Goal: {goal}
+- Title: {title}
+- Key Entities: {key_entities}
 """
 
 GRAPH_SYSTEM_PROMPT = """You are an expert at information analysis and relationship graph design. Your task is to analyze and process key entities as per the given instructions.
@@ -182,15 +192,16 @@ Every entity must be connected, meaning there is a path between every pair of en
 
 def generate_graph_data(title, key_entities, user_goal):
 
-    user_prompt = GRAPH_PROMPT.format(
+    user_prompt = build_prompt("graph_data", GRAPH_PROMPT, dict(
         goal=user_goal,
         title=title,
         key_entities=key_entities
-    )
+    ), strategies={"key_entities": "list"})
 
-    while True:
-        completion = client.chat.completions.create(
-            model="gpt-4o",
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "graph_data", refresh=refresh,
+            model=model,
             messages=[
                 {"role": "system", "content": GRAPH_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
@@ -199,12 +210,10 @@ def generate_graph_data(title, key_entities, user_goal):
             top_p=0.8
         )
 
-        try: 
-            response = completion.choices[0].message.content.strip()
-            return ast.literal_eval(re.sub(r"^```(python|json)?|```$", "", response).strip())
-        except (SyntaxError, ValueError) as e:
-            logger.warning(f"Encountered error parsing graph data: {e}")
-            logger.info("Retrying...")
+        response = completion.choices[0].message.content.strip()
+        return parse_output(response, "graph_data", expected=dict, required_keys=("nodes", "edges"))
+
+    return run_routed("graph_data", attempt)
 
 COLOR_SCHEME_PROMPT = """
 Your task is to analyze the given infographic data and suggest an appropriate color scheme that enhances clarity and visual appeal while matching the theme and overall message.
@@ -215,8 +224,6 @@ Instructions:
 3. Ensure sufficient contrast between text and background for readability. 
 4. Use only well-established, accessible color palettes (such as those from sources like Adobe Spectrum, ColorBrewer, or Material Design) to ensure clear and distinct color choices. Pay special attention to sequential palettes, ensuring lighter shades have enough contrast to stand out against the background.
 
-Here is the given information: {info}
-
 Output only the following in valid python dictionary format:
 {{
     "primary": {{
@@ -229,6 +236,8 @@ Output only the following in valid python dictionary format:
         "categorical_palette": ["#hex_code1", "#hex_code2", "#hex_code3", ...]
     }}
 }}
+
+Here is the given information: {info}
 """
 
 COLOR_SCHEME_SYSTEM_PROMPT = """
@@ -239,11 +248,12 @@ The output must be a Python dictionary, delimited with triple backticks, and sho
 
 def generate_color_scheme(refined_info):
     
-    user_prompt = COLOR_SCHEME_PROMPT.format(info=refined_info)
+    user_prompt = build_prompt("color_scheme", COLOR_SCHEME_PROMPT, dict(info=refined_info), strategies={"info": "dict"})
 
-    while True:
-        completion = client.chat.completions.create(
-            model="gpt-4o",
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "color_scheme", refresh=refresh,
+            model=model,
             messages=[
                 {"role": "system", "content": COLOR_SCHEME_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
@@ -251,12 +261,10 @@ def generate_color_scheme(refined_info):
             top_p=0.5
         )
 
-        try: 
-            response = completion.choices[0].message.content.strip()
-            return ast.literal_eval(re.sub(r"^```(python|json)?|```$", "", response).strip())
-        except (SyntaxError, ValueError) as e:
-            logger.warning(f"Encountered error parsing color scheme: {e}")
-            logger.info("Retrying...")
+        response = completion.choices[0].message.content.strip()
+        return parse_output(response, "color_scheme", expected=dict, required_keys=("primary", "data_viz"))
+
+    return run_routed("color_scheme", attempt)
 
 # Testing-------------------------------------------------------
 if __name__ == "__main__":
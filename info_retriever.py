@@ -1,64 +1,322 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from article_fetcher import fetch_articles
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
-from info_extractor import extract_info
-from openai import OpenAI
+from fact_index import FactIndex
+from info_extractor import EMPTY_EXTRACTED_INFO, extract_info
+from llm_client import create_completion, get_client
+from model_router import run_routed
+from output_parser import parse_output
+from prompt_builder import build_prompt
+from query_frontier import QueryFrontier
+from retry_policy import StageFailedError
+from token_ledger import submit_in_context
 import copy
 import json
+import logging
 import os
+import re
+import threading
 import time
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("PERPLEXITY_API_KEY"), base_url=os.getenv("PERPLEXITY_URL"))
+client = get_client("perplexity")
 
+FACT_CATEGORIES = ("statistical", "non_statistical")
 MIN_NUM_FACTS = 30
 MIN_CITATIONS = 5
-MAX_THREADS = min(5, os.cpu_count())
+EXTRACTION_THREADS = int(os.getenv("EXTRACTION_THREADS", 5))
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", 3))
+ANSWER_FIRST_RETRIEVAL = os.getenv("ANSWER_FIRST_RETRIEVAL", "false").lower() in ("1", "true", "yes")
+ANSWER_MIN_FACTS_PER_SOURCE = int(os.getenv("ANSWER_MIN_FACTS_PER_SOURCE", 2))
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() in ("1", "true", "yes")
 
-def retrieve_info(news_info, processed_urls, user_goal, threshold=MIN_NUM_FACTS):
+logger = logging.getLogger(__name__)
+
+SEARCH_FACTS_PROMPT = """Your task is to search for information answering the query and report the key facts you find, attributed to their sources.
+
+Instructions:
+1. Extract key facts from the sources you find.
+    - Statistical key facts: Identify claims supported by numerical data (e.g., percentages, financial figures, scientific measurements, population statistics).
+    - Non-statistical key facts: Identify significant qualitative insights, key events, statements that provide essential context or meaning.
+2. Attribute every fact to the sources it was taken from, using the 1-based numbers of your citations.
+3. Only report facts stated in the cited sources. Do not add facts that no source supports.
+4. Gather a list of key entities by extracting main subjects, relevant topics, or contextual factors related to the query.
+
+Output only the following in valid python dictionary format:
+{{
+    "key_facts": {{
+        "statistical": [{{"fact": "Fact 1", "sources": [1, 2]}}, ...],
+        "non_statistical": [{{"fact": "Fact 1", "sources": [3]}}, ...]
+    }},
+    "key_entities": ["Entity 1", "Entity 2", ...]
+}}
+
+Here is the query: {query}
+"""
+
+SEARCH_FACTS_SYSTEM_PROMPT = """You are an expert research assistant. Your task is to search for the query and extract key facts from the sources you cite as per the given instructions.
+
+The output must be a Python dictionary, delimited with triple backticks, and should not include any additional text, Markdown formatting, or escape characters.
+"""
+
+class SpeculativeRetrieval:
+    """Searches and downloads citations for title- and goal-derived queries before the seed extraction finishes."""
+
+    def __init__(self, title, processed_urls, user_goal):
+        self.queries = [title, f"{title} {user_goal}"]
+        self.stopped = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.queries))
+        self.searches = {
+            submit_in_context(self._executor, search_articles, query, set(processed_urls), self.stopped)
+            for query in self.queries
+        }
+        logger.info(f"Started {len(self.queries)} speculative searches")
+
+    def claim(self):
+        """Hands the pending searches to the caller; a speculation can only be consumed once."""
+        searches = {future for future in self.searches if not future.cancelled()}
+        self.searches = set()
+        return searches
+
+    def close(self):
+        self.stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def start_speculation(seed_article, processed_urls, user_goal):
+    if not SPECULATIVE_RETRIEVAL or seed_article is None or not seed_article["title"]:
+        return None
+    return SpeculativeRetrieval(seed_article["title"], processed_urls, user_goal)
+
+def retrieve_info(news_info, processed_urls, user_goal, threshold=MIN_NUM_FACTS, speculation=None):
     retrieved_info = copy.deepcopy(news_info)
     topic = retrieved_info["title"]
     key_facts = retrieved_info["key_facts"]
-    additional_queries = retrieved_info["additional_queries"]
     key_entities = retrieved_info["key_entities"]
 
-    while len(key_facts["statistical"]) < threshold or len(key_facts["non_statistical"]) < threshold:
-        if not additional_queries:
-            break
+    fact_indexes = index_facts(retrieved_info)
+    for category in FACT_CATEGORIES:
+        key_facts[category] = fact_indexes[category].facts()
 
-        query = additional_queries.pop(0)
-        response = query_relevant_articles(query)
-        new_urls = [url for url in response if url not in processed_urls]
+    # Speculative searches count as issued so the real queries that duplicate them are skipped
+    speculative = speculation.claim() if speculation is not None else set()
+    frontier = QueryFrontier()
+    if speculative:
+        frontier.mark_issued(speculation.queries)
+    frontier.extend(retrieved_info["additional_queries"])
+    frontier.add_facts(key_facts["statistical"] + key_facts["non_statistical"])
+
+    def has_enough_facts():
+        return len(key_facts["statistical"]) >= threshold and len(key_facts["non_statistical"]) >= threshold
+
+    def add_facts(attributed_facts, entities):
+        for category in FACT_CATEGORIES:
+            for fact, sources in attributed_facts[category]:
+                if fact_indexes[category].add(fact, sources=sources):
+                    key_facts[category].append(fact)
+                frontier.add_facts([fact])
+        key_entities.extend(entities)
+
+    stopped = threading.Event()
+    search_executor = ThreadPoolExecutor(max_workers=QUERY_CONCURRENCY)
+    extraction_executor = ThreadPoolExecutor(max_workers=EXTRACTION_THREADS)
+    searches = set()
+    extractions = {}
+    searches.update(speculative)
+    speculative_urls = 0
 
-        with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-            futures = {
-                executor.submit(extract_info, url, user_goal, topic): url
-                for url in new_urls
-            }
+    try:
+        while not has_enough_facts():
+            while frontier and len(searches - speculative) < QUERY_CONCURRENCY:
+                query = frontier.pop()
+                searches.add(submit_in_context(search_executor, search_articles, query, processed_urls, stopped))
 
-            for future in as_completed(futures):
-                news_url = futures[future]
-                extracted_info = future.result()
+            if not searches and not extractions:
+                break
 
-                processed_urls.add(news_url)
+            done, _ = wait(searches | extractions.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in searches:
+                    searches.remove(future)
+                    try:
+                        fetched_urls, failed_urls, answer = future.result()
+                    except StageFailedError as e:
+                        logger.warning(f"Skipping search: {e}")
+                        continue
+                    processed_urls.update(failed_urls)
+                    if answer is not None:
+                        processed_urls.update(answer["covered_urls"])
+                        add_facts(answer["key_facts"], answer["key_entities"])
+                        if has_enough_facts():
+                            break
 
-                key_facts["statistical"].extend(extracted_info["key_facts"]["statistical"])
-                key_facts["non_statistical"].extend(extracted_info["key_facts"]["non_statistical"])
-                key_entities.extend(extracted_info["key_entities"])
-                additional_queries.extend(extracted_info["additional_queries"])
+                    for url in fetched_urls:
+                        if url in processed_urls:
+                            continue
+                        processed_urls.add(url)
+                        if future in speculative:
+                            speculative_urls += 1
+                        extractions[submit_in_context(extraction_executor, extract_info, url, user_goal, topic)] = url
+                    continue
 
+                news_url = extractions.pop(future)
+                try:
+                    extracted_info = future.result()
+                except StageFailedError as e:
+                    # The URL stays processed so later searches do not fetch it again
+                    logger.warning(f"Skipping {news_url}: {e}")
+                    extracted_info = EMPTY_EXTRACTED_INFO
+
+                add_facts(
+                    {
+                        category: [(fact, [news_url]) for fact in extracted_info["key_facts"][category]]
+                        for category in FACT_CATEGORIES
+                    },
+                    extracted_info["key_entities"]
+                )
+                frontier.extend(extracted_info["additional_queries"])
+
+                if has_enough_facts():
+                    break
+    finally:
+        stopped.set()
+        search_executor.shutdown(wait=False, cancel_futures=True)
+        extraction_executor.shutdown(wait=False, cancel_futures=True)
+        if speculation is not None:
+            speculation.close()
+
+    if searches or extractions:
+        logger.info(f"Fact threshold reached, cancelled {len(searches)} searches and {len(extractions)} extractions")
+    if speculative:
+        logger.info(f"Used {speculative_urls} articles from speculative searches, dropped {len(speculative & searches)} unfinished searches")
+
+    retrieved_info["fact_provenance"] = {
+        category: fact_indexes[category].provenance() for category in FACT_CATEGORIES
+    }
+    logger.info(f"Query frontier rejected {frontier.rejected} duplicate or low-novelty queries")
     retrieved_info.pop("additional_queries")
     return retrieved_info
 
+def index_facts(retrieved_info):
+    provenance = retrieved_info.get("fact_provenance", {})
+    fact_indexes = {}
+
+    for category in FACT_CATEGORIES:
+        fact_indexes[category] = FactIndex(match_numbers=category == "statistical")
+        sources = provenance.get(category, [])
+        for idx, fact in enumerate(retrieved_info["key_facts"][category]):
+            source = sources[idx] if idx < len(sources) else {"count": 1, "sources": []}
+            fact_indexes[category].add(fact, sources=source["sources"], count=source["count"])
+
+    return fact_indexes
+
+def merge_retrieved_info(retrieved_info, extra_info):
+    fact_indexes = index_facts(retrieved_info)
+    extra_provenance = extra_info.get("fact_provenance", {})
+
+    for category in FACT_CATEGORIES:
+        sources = extra_provenance.get(category, [])
+        for idx, fact in enumerate(extra_info["key_facts"][category]):
+            source = sources[idx] if idx < len(sources) else {"count": 1, "sources": []}
+            fact_indexes[category].add(fact, sources=source["sources"], count=source["count"])
+
+        retrieved_info["key_facts"][category] = fact_indexes[category].facts()
+
+    retrieved_info["fact_provenance"] = {
+        category: fact_indexes[category].provenance() for category in FACT_CATEGORIES
+    }
+    retrieved_info["key_entities"].extend(extra_info["key_entities"])
+    return retrieved_info
+
+def search_articles(query, processed_urls, stopped):
+    if ANSWER_FIRST_RETRIEVAL:
+        answer = query_answer_facts(query)
+        response = answer["thin_urls"]
+    else:
+        answer = None
+        response = query_relevant_articles(query)
+
+    new_urls = [url for url in response if url not in processed_urls]
+    if stopped.is_set() or not new_urls:
+        return [], [], answer
+
+    articles = fetch_articles(new_urls)
+    fetched_urls = [url for url in new_urls if articles[url] is not None]
+    failed_urls = [url for url in new_urls if articles[url] is None]
+    return fetched_urls, failed_urls, answer
+
 def query_relevant_articles(query):
-    completion = client.chat.completions.create(
-        model="sonar-pro", 
+    completion = run_routed("search", lambda refresh, model: create_completion(
+        client, "search", refresh=refresh,
+        model=model,
         messages=[
             {"role": "user", "content": query}
         ],
         top_p=0.8
-    )
+    ), retry_on=())
     return completion.citations[:MIN_CITATIONS]
 
+def query_answer_facts(query):
+    """Asks the search model for attributed facts, returning them with the citations they cover too thinly."""
+    user_prompt = build_prompt("search_facts", SEARCH_FACTS_PROMPT, dict(query=query))
+
+    def attempt(refresh, model):
+        completion = create_completion(
+            client, "search_facts", refresh=refresh,
+            model=model,
+            messages=[
+                {"role": "system", "content": SEARCH_FACTS_SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            top_p=0.8
+        )
+        response = completion.choices[0].message.content.strip()
+        answer = parse_output(response, "search_facts", expected=dict, required_keys=("key_facts",))
+        return attribute_facts(answer, completion.citations)
+
+    return run_routed("search_facts", attempt)
+
+def attribute_facts(answer, citations):
+    """Maps 1-based citation numbers to URLs and splits citations by how many facts they back."""
+    if not isinstance(answer, dict) or not isinstance(answer.get("key_facts", {}), dict):
+        raise ValueError(f"Search answer is not a fact dictionary: {str(answer)[:100]}")
+
+    key_facts = {}
+    coverage = dict.fromkeys(citations, 0)
+
+    for category in FACT_CATEGORIES:
+        key_facts[category] = []
+        for item in answer.get("key_facts", {}).get(category, []):
+            if isinstance(item, dict):
+                fact, numbers = item.get("fact", ""), item.get("sources", [])
+            else:
+                fact, numbers = item, []
+            if not isinstance(numbers, list):
+                numbers = [numbers]
+
+            fact = re.sub(r"\s*\[\d+\]", "", str(fact)).strip()
+            sources = [
+                citations[number - 1] for number in numbers
+                if isinstance(number, int) and 0 < number <= len(citations)
+            ]
+            if not fact:
+                continue
+
+            key_facts[category].append((fact, sources))
+            for url in sources:
+                coverage[url] += 1
+
+    cited = citations[:MIN_CITATIONS]
+    covered_urls = [url for url in cited if coverage[url] >= ANSWER_MIN_FACTS_PER_SOURCE]
+    thin_urls = [url for url in cited if coverage[url] < ANSWER_MIN_FACTS_PER_SOURCE]
+    logger.info(f"Search answer gave {sum(map(len, key_facts.values()))} facts, {len(thin_urls)} of {len(cited)} citations need downloading")
+
+    return {
+        "key_facts": key_facts,
+        "key_entities": answer.get("key_entities", []),
+        "covered_urls": covered_urls,
+        "thin_urls": thin_urls
+    }
+
 # Testing-------------------------------------------------------
 if __name__ == "__main__":
     with open("./enh_news_info/test/test_news_info.txt", "r") as f:
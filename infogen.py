@@ -1,19 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from info_extractor import extract_info
-from info_retriever import retrieve_info
-from info_manager import manage_info
+from info_extractor import extract_article, load_article
+from info_retriever import retrieve_info, merge_retrieved_info, start_speculation
+from info_manager import refine_facts, generate_graph_data, finalize_refined_data
 from figure_generator import generate_figures
 from graph_generator import generate_graph
 from layout_generator import *
+from llm_cache import cache_stats
+from model_router import latency_stats
+from output_parser import parse_stats
+from pipeline import Stage, run_stages, dependents, invalidate
 from renderer import render
+from token_ledger import ledger_session, submit_in_context
 from evaluator import evaluate
 from util import *
 import copy
 import json
 import logging
+import os
+import threading
 
 TARGET_SCORE = 21
+MOD_TRIES = 3
+LAYOUT_CANDIDATES = int(os.getenv("LAYOUT_CANDIDATES", 1))
 
 DEFAULT_FEEDBACK = {
     "regen_layout": True,
@@ -27,93 +37,94 @@ DEFAULT_FEEDBACK = {
 
 logger = logging.getLogger(__name__)
 
-def generate_infographic(article_url, user_request, out_dir):
-    logger.info("Extracting and analyzing news content...")
-    news_info = extract_info(article_url, user_request)
-    processed_urls = set([article_url])
-
-    logger.info("Searching for additional information...")
-    retrieved_data = retrieve_info(news_info, processed_urls, user_request)
-
-    logger.info("Processing retrieved data...")
-    refined_data = manage_info(retrieved_data, user_request)
-
-    title = refined_data["title"]
-    key_facts = refined_data["key_facts"]["non_statistical"]
-    stats_data = refined_data["key_facts"]["statistical"]
-    graph_data = refined_data["graph"]
-    color_scheme = refined_data["colors"]
-    
-    logger.info("Visualizing statistical data...")
-    figure_data = generate_figures(stats_data, color_scheme)
-    figure_specs = save_figures(figure_data, out_dir)
-
-    logger.info("Generating graph...")
-    graph, graph_spec = generate_graph(
-        graph_data, color_scheme
-    )
-    save_graph(graph, graph_spec, out_dir)
-
-    info_img, html_code, evaluation = process_infographic(
-        title=title, 
-        key_facts=key_facts, 
-        figure_specs=figure_specs, 
-        graph_spec=graph_spec, 
-        color_scheme=color_scheme, 
-        suggestions=user_request,
-        out_dir=out_dir
+INFOGRAPHIC_STAGES = [
+    Stage(
+        "processed_urls", lambda article_url: set([article_url]),
+        deps=("article_url",)
+    ),
+    Stage(
+        "seed_article", load_article,
+        deps=("article_url",)
+    ),
+    Stage(
+        "news_info", extract_article,
+        deps=("seed_article", "user_request"),
+        description="Extracting and analyzing news content..."
+    ),
+    Stage(
+        "speculation", start_speculation,
+        deps=("seed_article", "processed_urls", "user_request"),
+        cleanup=lambda speculation: speculation.close() if speculation is not None else None
+    ),
+    Stage(
+        "retrieved_data",
+        lambda news_info, processed_urls, user_request, speculation: retrieve_info(
+            news_info, processed_urls, user_request, speculation=speculation
+        ),
+        deps=("news_info", "processed_urls", "user_request", "speculation"),
+        description="Searching for additional information..."
+    ),
+    Stage(
+        "refined_facts", refine_facts,
+        deps=("retrieved_data", "user_request"),
+        description="Processing retrieved data..."
+    ),
+    Stage(
+        "graph_data",
+        lambda retrieved_data, user_request: generate_graph_data(
+            retrieved_data["title"], retrieved_data["key_entities"], user_request
+        ),
+        deps=("retrieved_data", "user_request"),
+        description="Extracting entity relations..."
+    ),
+    Stage(
+        "refined_data", finalize_refined_data,
+        deps=("refined_facts", "graph_data"),
+        description="Generating color scheme..."
+    ),
+    Stage(
+        "figure_data",
+        lambda refined_data: generate_figures(refined_data["key_facts"]["statistical"], refined_data["colors"]),
+        deps=("refined_data",),
+        description="Visualizing statistical data..."
+    ),
+    Stage(
+        "graph",
+        lambda refined_data: generate_graph(refined_data["graph"], refined_data["colors"]),
+        deps=("refined_data",),
+        outputs=("graph", "graph_spec"),
+        description="Generating graph..."
     )
+]
 
-    info_metadata = {
-        "url": article_url,
-        "title": title,
-        "facts": key_facts,
-        "stats": stats_data,
-        "graph": graph_data,
-        "color_scheme": color_scheme,
-        "f_specs": figure_specs,
-        "g_specs": graph_spec,
-        "html": html_code
-    }
-    
-    save_infographic(info_img, info_metadata, out_dir)
+# Redrawn only on regen_figures / regen_graph, even when the content they were drawn from changes
+VISUAL_OUTPUTS = ("figure_data", "graph", "graph_spec")
 
-    forward_metadata = {
-        "article_url": article_url,
-        "user_request": user_request,
-        "processed_urls": processed_urls,
-        "retrieved_data": retrieved_data,
-        "refined_data": refined_data,
-        "figure_data": figure_data,
-        "graph": graph,
-        "graph_spec": graph_spec,
-        "html_code": html_code
-    }
+def generate_infographic(article_url, user_request, out_dir):
+    with ledger_session() as ledger:
+        results = run_stages(INFOGRAPHIC_STAGES, {
+            "article_url": article_url,
+            "user_request": user_request
+        })
+        output = finish_infographic(results, out_dir)
 
-    return info_img, forward_metadata, evaluation
+    save_ledger(ledger, out_dir)
+    return output
 
 def modify_infographic(forward_metadata, user_feedback, out_dir):
-    article_url = forward_metadata["article_url"]
-    user_request = forward_metadata["user_request"]
-    processed_urls = forward_metadata["processed_urls"]
-    retrieved_data = forward_metadata["retrieved_data"]
-    refined_data = forward_metadata["refined_data"]
-    figure_data = forward_metadata["figure_data"]
-    graph = forward_metadata["graph"]
-    graph_spec = forward_metadata["graph_spec"]
-    html_code = forward_metadata["html_code"]
+    with ledger_session() as ledger:
+        output = update_infographic(forward_metadata, user_feedback, out_dir)
 
-    if user_feedback["regen_content"]:
-        logger.info("Extracting and analyzing news content...")
-        news_info = extract_info(article_url, user_request)
-        processed_urls = set([article_url])
+    save_ledger(ledger, out_dir)
+    return output
 
-        logger.info("Searching for additional information...")
-        retrieved_data = retrieve_info(news_info, processed_urls, user_request)
+def update_infographic(forward_metadata, user_feedback, out_dir):
+    results = dict(forward_metadata)
 
-        logger.info("Processing retrieved data...")
-        refined_data = manage_info(retrieved_data, user_request)
+    if user_feedback["regen_content"]:
+        results = invalidate_content(results, ["processed_urls", "news_info"])
     elif user_feedback["lack_content"]:
+        retrieved_data = results["retrieved_data"]
         temp = {
             "title": retrieved_data["title"],
             "key_facts": {"statistical": [], "non_statistical": []},
@@ -122,83 +133,83 @@ def modify_infographic(forward_metadata, user_feedback, out_dir):
         }
 
         logger.info("Searching for additional information...")
-        extra_data = retrieve_info(temp, processed_urls, user_request, 15)
-        retrieved_data["key_facts"]["statistical"].extend(extra_data["key_facts"]["statistical"])
-        retrieved_data["key_facts"]["non_statistical"].extend(extra_data["key_facts"]["non_statistical"])
-        retrieved_data["key_entities"].extend(extra_data["key_entities"])
+        extra_data = retrieve_info(temp, results["processed_urls"], results["user_request"], 15)
+        merge_retrieved_info(retrieved_data, extra_data)
+
+        results = invalidate_content(results, dependents(INFOGRAPHIC_STAGES, ["retrieved_data"]))
 
-        logger.info("Processing additional retrieved data...")
-        refined_data = manage_info(retrieved_data, user_request)
+    if user_feedback["regen_figures"]:
+        results = invalidate(INFOGRAPHIC_STAGES, results, ["figure_data"])
+
+    if user_feedback["regen_graph"]:
+        results = invalidate(INFOGRAPHIC_STAGES, results, ["graph"])
+
+    results = run_stages(INFOGRAPHIC_STAGES, results)
+    return finish_infographic(results, out_dir, user_feedback)
+
+def invalidate_content(results, names):
+    """Invalidates `names` and downstream content, keeping figures and the graph unless their flags ask for them."""
+    kept = {key: results[key] for key in VISUAL_OUTPUTS if key in results}
+    return {**invalidate(INFOGRAPHIC_STAGES, results, names), **kept}
 
+def finish_infographic(results, out_dir, user_feedback=DEFAULT_FEEDBACK):
+    refined_data = results["refined_data"]
     title = refined_data["title"]
     key_facts = refined_data["key_facts"]["non_statistical"]
     stats_data = refined_data["key_facts"]["statistical"]
     graph_data = refined_data["graph"]
     color_scheme = refined_data["colors"]
-    
-    if user_feedback["regen_figures"]:
-        logger.info("Visualizing statistical data...")
-        figure_data = generate_figures(stats_data, color_scheme)
 
-    figure_specs = save_figures(figure_data, out_dir)
-
-    if user_feedback["regen_graph"]:
-        logger.info("Generating graph...")
-        graph, graph_spec = generate_graph(
-            graph_data, color_scheme
-        )
-    
-    save_graph(graph, graph_spec, out_dir)
+    figure_specs = save_figures(results["figure_data"], out_dir)
+    save_graph(results["graph"], results["graph_spec"], out_dir)
 
     info_img, html_code, evaluation = process_infographic(
         title=title, 
         key_facts=key_facts, 
         figure_specs=figure_specs, 
-        graph_spec=graph_spec, 
+        graph_spec=results["graph_spec"], 
         color_scheme=color_scheme, 
-        suggestions=user_request,
+        suggestions=results["user_request"],
         out_dir=out_dir,
         user_feedback=user_feedback, 
-        html_code=html_code
+        html_code=results.get("html_code")
     )
 
     info_metadata = {
-        "url": article_url,
+        "url": results["article_url"],
         "title": title,
         "facts": key_facts,
         "stats": stats_data,
         "graph": graph_data,
         "color_scheme": color_scheme,
         "f_specs": figure_specs,
-        "g_specs": graph_spec,
+        "g_specs": results["graph_spec"],
         "html": html_code
     }
     
     save_infographic(info_img, info_metadata, out_dir)
+    logger.info(f"LLM cache stats: {cache_stats()}")
+    logger.info(f"Output parse stats: {parse_stats()}")
+    logger.info(f"LLM latency stats: {latency_stats()}")
 
-    forward_metadata = {
-        "article_url": article_url,
-        "user_request": user_request,
-        "processed_urls": processed_urls,
-        "retrieved_data": retrieved_data,
-        "refined_data": refined_data,
-        "figure_data": figure_data,
-        "graph": graph,
-        "graph_spec": graph_spec,
-        "html_code": html_code
-    }
-
+    forward_metadata = dict(results, html_code=html_code)
     return info_img, forward_metadata, evaluation
 
 def process_infographic(
     title, key_facts, figure_specs, graph_spec, color_scheme, 
     suggestions, out_dir, user_feedback=DEFAULT_FEEDBACK, html_code=None
     ):
+    if LAYOUT_CANDIDATES > 1:
+        return search_infographic(
+            title, key_facts, figure_specs, graph_spec, color_scheme,
+            suggestions, out_dir, user_feedback, html_code
+        )
+
     info_color_scheme = color_scheme["primary"]
     
-    mod_tries = 3
+    mod_tries = MOD_TRIES
     mod_hist = {
-        "infographic_hist": [],
+        "html_hist": [],
         "eval_hist": []
     }
 
@@ -213,8 +224,8 @@ def process_infographic(
         
         if verify_html(html_code):
             html_path = save_html(html_code, out_dir)
-            info_img = render(html_path)
-            evaluation = evaluate(info_img)
+            info_img, geometry = render(html_path, tier="draft", with_geometry=True)
+            evaluation = evaluate(info_img, geometry)
 
             eval_score = get_eval_score(evaluation)
             if eval_score < TARGET_SCORE:
@@ -223,7 +234,7 @@ def process_infographic(
                     user_feedback["modify_layout"] = True
                     user_feedback["inputs"]["suggestions"] = evaluation["suggestions"]
 
-                    mod_hist["infographic_hist"].append(info_img)
+                    mod_hist["html_hist"].append(html_code)
                     mod_hist["eval_hist"].append(evaluation)
                     mod_tries -= 1
                     logger.info(f"Generated layout failed evaluation. Refining... (Attempts remaining: {mod_tries})")
@@ -234,11 +245,105 @@ def process_infographic(
                         range(len(mod_hist["eval_hist"])), 
                         key=lambda i: get_eval_score(mod_hist["eval_hist"][i])
                     )
-                    info_img = mod_hist["infographic_hist"][max_score_index]
+                    html_code = mod_hist["html_hist"][max_score_index]
                     evaluation = mod_hist["eval_hist"][max_score_index]
 
             break
         else:
             logger.info("HTML verification failed. Retrying...")
 
+    logger.info("Rendering final infographic...")
+    html_path = save_html(html_code, out_dir)
+    info_img = render(html_path, tier="final")
+
+    return info_img, html_code, evaluation
+
+def search_infographic(
+    title, key_facts, figure_specs, graph_spec, color_scheme,
+    suggestions, out_dir, user_feedback=DEFAULT_FEEDBACK, html_code=None
+    ):
+    info_color_scheme = color_scheme["primary"]
+    modify = user_feedback["modify_layout"]
+    if modify:
+        suggestions = user_feedback["inputs"]["suggestions"]
+
+    # With neither layout flag set (e.g. only the graph was redrawn) the current layout is kept and re-scored
+    keep_existing = not modify and not user_feedback["regen_layout"] and html_code is not None
+
+    mod_tries = MOD_TRIES
+    search_round = 0
+    best = None
+    found = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=LAYOUT_CANDIDATES)
+
+    try:
+        while mod_tries > 0 and not found.is_set():
+            num_candidates = LAYOUT_CANDIDATES
+            if keep_existing:
+                logger.info("Evaluating current infographic...")
+                make_html = lambda base=html_code: base
+                num_candidates = 1
+                keep_existing = False
+            elif modify:
+                logger.info(f"Modifying infographic with {LAYOUT_CANDIDATES} candidates...")
+                make_html = lambda base=html_code, req=suggestions: polish_layout(
+                    title, key_facts, figure_specs, graph_spec, base, req
+                )
+            else:
+                logger.info(f"Processing infographic with {LAYOUT_CANDIDATES} candidates...")
+                make_html = lambda req=suggestions: generate_layout(
+                    title, key_facts, figure_specs, graph_spec, info_color_scheme, req
+                )
+
+            futures = [
+                submit_in_context(executor, build_candidate, make_html, out_dir, f"layout_{search_round}_{idx}.html", found)
+                for idx in range(num_candidates)
+            ]
+            search_round += 1
+
+            round_valid = False
+            for future in as_completed(futures):
+                candidate = future.result()
+                if candidate is None:
+                    continue
+
+                round_valid = True
+                score = get_eval_score(candidate[1])
+                if best is None or score > best[0]:
+                    best = (score, *candidate)
+                if score >= TARGET_SCORE:
+                    found.set()
+                    break
+
+            if not round_valid:
+                logger.info("HTML verification failed for all candidates. Retrying...")
+                continue
+
+            mod_tries -= 1
+            if not found.is_set():
+                modify = True
+                html_code = best[1]
+                suggestions = best[2]["suggestions"]
+                logger.info(f"Best candidate scored {best[0]}, below target. Refining... (Attempts remaining: {mod_tries})")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    _, html_code, evaluation = best
+
+    logger.info("Rendering final infographic...")
+    html_path = save_html(html_code, out_dir)
+    info_img = render(html_path, tier="final")
+
     return info_img, html_code, evaluation
+
+def build_candidate(make_html, out_dir, h_name, found):
+    if found.is_set():
+        return None
+
+    html_code = make_html()
+    if found.is_set() or not verify_html(html_code):
+        return None
+
+    html_path = save_html(html_code, out_dir, h_name)
+    info_img, geometry = render(html_path, tier="draft", with_geometry=True)
+    return html_code, evaluate(info_img, geometry)
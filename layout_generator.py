@@ -2,18 +2,18 @@ from bs4 import BeautifulSoup
 from datetime import datetime
 from dotenv import load_dotenv
 from layout_rules import InfographicLayoutRules
-from openai import OpenAI
+from llm_client import create_completion, get_client
+from model_router import run_routed
 from PIL import Image
+from prompt_builder import build_prompt
 from util import encode_img
 import io
 import json
-import openai
-import os
 import re
 import webbrowser
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
 
 SPECIFICATION_RULES = {name: member.value for name, member in InfographicLayoutRules.__members__.items()}
 
@@ -33,6 +33,8 @@ Instructions:
 6. You are not required to use all provided elements (e.g. figures), only use the most relevant information to maintain clarity and readability, optimizing space effectively.
 7. Strictly apply the provided color scheme consistently throughout the layout.
 
+The output layout should be in HTML code.
+
 Here is the data:
 - Infographic Title: {title}
 - Key Facts: {facts}
@@ -40,8 +42,6 @@ Here is the data:
 - Graph Image: {g_spec}
 - Color scheme: {color}
 - Suggestions: {suggest}
-
-The output layout should be in HTML code.
 """
 
 GENERATE_HTML_SYSTEM_PROMPT = """
@@ -54,26 +54,26 @@ Follow these predefined rules strictly: {rules}
 3. The infographic should be enclosed within a container element with the class "infographic-container".
 
 The outputted HTML code must be delimited with triple backticks, and should not include any additional text, Markdown formatting, or escape characters.
-"""
+""".format(rules=SPECIFICATION_RULES)
 
 def generate_layout(title, key_facts, figure_specs, graph_spec, color_scheme, suggestions):
-    user_prompt = GENERATE_HTML_PROMPT.format(
+    user_prompt = build_prompt("layout", GENERATE_HTML_PROMPT, dict(
         title=title,
         facts=key_facts,
         f_spec=figure_specs,
         g_spec=graph_spec,
         color=color_scheme,
-        suggest=suggestions,
-        rules=SPECIFICATION_RULES
-    )
+        suggest=suggestions
+    ), strategies={"facts": "list"})
     
-    completion = client.chat.completions.create(
-        model='gpt-4o',
+    completion = run_routed("layout", lambda refresh, model: create_completion(
+        client, "layout", refresh=refresh,
+        model=model,
         messages=[
             {"role": "system", "content": GENERATE_HTML_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
-    )
+    ), retry_on=())
 
     response = completion.choices[0].message.content.strip()
     return re.sub(r"^```(html)?|```$", "", response).strip()
@@ -81,19 +81,21 @@ def generate_layout(title, key_facts, figure_specs, graph_spec, color_scheme, su
 POLISH_HTML_PROMPT = """
 Your task is to polish and adjust the HTML code based on the user requests.
 
-HTML code: 
-{html}
+The reference data below was used to create this infographic. Please reference these sources if any changes are requested.
 
-User request: 
-{req}
+The output layout should be in HTML code.
 
-Below is the reference data used to create this infographic. Please reference these sources if any changes are requested:
+Reference data:
 - Title: {title}
 - Key Facts: {facts}
 - Figures: {f_spec}
 - Graphs: {g_spec}
 
-The output layout should be in HTML code.
+HTML code: 
+{html}
+
+User request: 
+{req}
 """
 
 POLISH_HTML_SYSTEM_PROMPT = """
@@ -106,26 +108,26 @@ Follow these predefined rules strictly: {rules}
 3. The infographic should be enclosed within a container element with the class "infographic-container".
 
 The outputted HTML code must be delimited with triple backticks, and should not include any additional text, Markdown formatting, or escape characters.
-"""
+""".format(rules=SPECIFICATION_RULES)
 
 def polish_layout(title, key_facts, figure_specs, graph_spec, html_code, user_request):
-    user_prompt = POLISH_HTML_PROMPT.format(
+    user_prompt = build_prompt("polish_layout", POLISH_HTML_PROMPT, dict(
         html=html_code,
         req=user_request,
         title=title,
         facts=key_facts,
         f_spec=figure_specs,
-        g_spec=graph_spec,
-        rules=SPECIFICATION_RULES
-    )
+        g_spec=graph_spec
+    ), strategies={"html": "html", "facts": "list"})
 
-    completion = client.chat.completions.create(
-        model='gpt-4o',
+    completion = run_routed("polish_layout", lambda refresh, model: create_completion(
+        client, "polish_layout", refresh=refresh,
+        model=model,
         messages=[
             {"role": "system", "content": POLISH_HTML_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
-    )
+    ), retry_on=())
 
     response = completion.choices[0].message.content.strip()
     return re.sub(r"^```(html)?|```$", "", response).strip()
@@ -0,0 +1,120 @@
+from dotenv import load_dotenv
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+load_dotenv()
+LLM_CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", "./enh_news_info/cache/llm_cache.db"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 60 * 60))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+# Stages whose output should vary between runs (e.g. layout or figure regeneration) bypass the cache
+CACHED_STAGES = {
+    "extract_info": True,
+    "search": True,
+    "search_facts": True,
+    "refine_facts": True,
+    "structure_check": True,
+    "graph_data": True,
+    "color_scheme": True,
+    "figure": False,
+    "graph_layout": False,
+    "layout": False,
+    "polish_layout": False,
+    "evaluate": True,
+    "suggestions": True
+}
+for stage in filter(None, os.getenv("LLM_CACHE_BYPASS_STAGES", "").split(",")):
+    CACHED_STAGES[stage.strip()] = False
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """SQLite-backed LRU cache of serialized completions with a TTL."""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {}
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, stage TEXT, response TEXT, created REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(params):
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, stage, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            elif row:
+                self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+            self._record(stage, "hits" if row else "misses")
+        return row[0] if row else None
+
+    def put(self, stage, key, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, stage, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, response, now, now)
+            )
+
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def snapshot_stats(self):
+        with self._lock:
+            return {stage: dict(stats) for stage, stats in self.stats.items()}
+
+    def _record(self, stage, outcome):
+        stage_stats = self.stats.setdefault(stage, {"hits": 0, "misses": 0})
+        stage_stats[outcome] += 1
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+def is_cached_stage(stage):
+    return LLM_CACHE_ENABLED and CACHED_STAGES.get(stage, False)
+
+def cache_stats():
+    if _cache is None:
+        return {}
+    return _cache.snapshot_stats()
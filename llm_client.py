@@ -0,0 +1,142 @@
+from dotenv import load_dotenv
+from llm_cache import get_response_cache, is_cached_stage
+from model_router import record_latency
+from openai import APIStatusError, APITimeoutError, DefaultHttpxClient, OpenAI, RateLimitError
+from openai.types.chat import ChatCompletion
+from prompt_builder import check_prefix_stability, count_tokens
+from rate_limiter import get_model_throttle
+from retry_policy import TRANSIENT_ERRORS, get_circuit_breaker
+from token_ledger import current_ledger
+import httpx
+import logging
+import os
+import threading
+import time
+
+load_dotenv()
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", 32))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60.0))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 180.0))
+
+# Environment variables holding the API key and base URL of each provider
+PROVIDERS = {
+    "openai": ("OPENAI_API_KEY", None),
+    "perplexity": ("PERPLEXITY_API_KEY", "PERPLEXITY_URL")
+}
+
+# Images are billed per tile; this is a conservative flat estimate for rate limiting
+IMAGE_TOKEN_ESTIMATE = 1000
+DEFAULT_COMPLETION_ESTIMATE = 1000
+
+logger = logging.getLogger(__name__)
+
+_http_client = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(provider="openai"):
+    """Returns the process-wide client for `provider`, sharing one keep-alive connection pool."""
+    global _http_client
+
+    with _clients_lock:
+        if provider not in _clients:
+            if _http_client is None:
+                _http_client = DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                    ),
+                    timeout=LLM_REQUEST_TIMEOUT
+                )
+
+            key_var, url_var = PROVIDERS[provider]
+            # Retries are handled by retry_policy so they are not multiplied inside the SDK
+            _clients[provider] = OpenAI(
+                api_key=os.getenv(key_var),
+                base_url=os.getenv(url_var) if url_var else None,
+                max_retries=0,
+                http_client=_http_client
+            )
+        return _clients[provider]
+
+def create_completion(client, stage, refresh=False, **params):
+    """Creates a chat completion, served from the response cache when the stage allows it."""
+    check_prefix_stability(stage, params["messages"])
+
+    if not is_cached_stage(stage):
+        return request_completion(client, stage, **params)
+
+    cache = get_response_cache()
+    key = cache.make_key({"base_url": str(client.base_url), **params})
+
+    # Retries pass refresh=True so an unparsable cached response gets replaced
+    if not refresh:
+        cached = cache.get(stage, key)
+        if cached is not None:
+            logger.info(f"LLM cache hit for {stage}")
+            completion = ChatCompletion.model_validate_json(cached)
+            record_usage(stage, params["model"], completion, 0.0, cached=True)
+            return completion
+
+    completion = request_completion(client, stage, **params)
+    cache.put(stage, key, completion.model_dump_json())
+    return completion
+
+def request_completion(client, stage, **params):
+    breaker = get_circuit_breaker(f"{client.base_url} {params['model']}")
+    probing = breaker.before_call(stage)
+
+    throttle = get_model_throttle(params["model"])
+    estimated_tokens = estimate_request_tokens(params)
+    try:
+        with throttle.slot(estimated_tokens) as outcome:
+            start = time.perf_counter()
+            try:
+                completion = client.chat.completions.create(**params)
+            except TRANSIENT_ERRORS as e:
+                outcome["throttled"] = isinstance(e, (RateLimitError, APITimeoutError))
+                breaker.record_failure()
+                raise
+            except APIStatusError:
+                # The provider answered, so the endpoint is up even though this request was rejected
+                breaker.record_success()
+                raise
+            latency = time.perf_counter() - start
+            outcome["succeeded"] = True
+
+        breaker.record_success()
+    finally:
+        if probing:
+            breaker.end_probe()
+
+    record_latency(stage, params["model"], latency)
+    if completion.usage:
+        throttle.tokens.charge(completion.usage.total_tokens - estimated_tokens)
+    record_usage(stage, params["model"], completion, latency)
+    return completion
+
+def estimate_request_tokens(params):
+    tokens = params.get("max_tokens") or DEFAULT_COMPLETION_ESTIMATE
+    for message in params["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += count_tokens(content)
+            continue
+        for part in content:
+            tokens += count_tokens(part["text"]) if part["type"] == "text" else IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+def record_usage(stage, model, completion, latency, cached=False):
+    ledger = current_ledger()
+    if ledger is None:
+        return
+
+    usage = completion.usage
+    ledger.record(
+        stage, model,
+        usage.prompt_tokens if usage else 0,
+        usage.completion_tokens if usage else 0,
+        latency, cached=cached
+    )
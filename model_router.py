@@ -0,0 +1,123 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from rate_limiter import LLM_MAX_CONCURRENCY
+from retry_policy import CircuitOpenError, run_with_retries
+from token_ledger import submit_in_context
+import logging
+import numpy as np
+import os
+import threading
+import time
+
+load_dotenv()
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "true").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+LATENCY_WINDOW = 200
+
+# Primary model first; the next one is used for hedges and when the primary's circuit is open
+STAGE_MODELS = {
+    "extract_info": ["gpt-4o"],
+    "search": ["sonar-pro"],
+    "search_facts": ["sonar-pro"],
+    "refine_facts": ["gpt-4.5-preview", "gpt-4o"],
+    "structure_check": ["gpt-4o-mini"],
+    "graph_data": ["gpt-4o"],
+    "color_scheme": ["gpt-4o", "gpt-4o-mini"],
+    "figure": ["o3-mini", "gpt-4o"],
+    "graph_layout": ["gpt-4o-mini", "gpt-4o"],
+    "layout": ["gpt-4o"],
+    "polish_layout": ["gpt-4o"],
+    "evaluate": ["gpt-4o"],
+    "suggestions": ["gpt-4o"]
+}
+
+# Enough workers for every routed model to reach its concurrency limit, so the pool never queues
+# calls the rate limiter would admit
+HEDGE_WORKERS = LLM_MAX_CONCURRENCY * len({model for models in STAGE_MODELS.values() for model in models})
+
+logger = logging.getLogger(__name__)
+
+_latencies = {}
+_latencies_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+def primary_model(stage):
+    return STAGE_MODELS[stage][0]
+
+def record_latency(stage, model, latency):
+    with _latencies_lock:
+        _latencies.setdefault((stage, model), deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+def latency_percentile(stage, model, percentile):
+    with _latencies_lock:
+        samples = list(_latencies.get((stage, model), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return float(np.percentile(samples, percentile))
+
+def latency_stats():
+    with _latencies_lock:
+        samples = {key: list(values) for key, values in _latencies.items()}
+    return {
+        f"{stage}/{model}": {
+            "calls": len(values),
+            "p50": round(float(np.percentile(values, 50)), 2),
+            "p95": round(float(np.percentile(values, 95)), 2)
+        }
+        for (stage, model), values in samples.items()
+    }
+
+def hedged_call(stage, call):
+    """Runs `call(model)` on the stage's primary model, racing a hedge once it outlives the p95."""
+    models = STAGE_MODELS[stage]
+    primary = models[0]
+    fallback = models[1] if len(models) > 1 else primary
+
+    hedge_after = latency_percentile(stage, primary, HEDGE_PERCENTILE) if HEDGING_ENABLED else None
+    started = threading.Event()
+    futures = {submit_in_context(_hedge_executor, start_call, call, primary, started): primary}
+    hedged = False
+
+    if hedge_after is not None:
+        # Time spent waiting for a worker does not count towards the hedge delay
+        started.wait()
+        hedge_at = time.monotonic() + hedge_after
+
+    while futures:
+        timeout = None if hedged or hedge_after is None else max(0.0, hedge_at - time.monotonic())
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            logger.info(f"{stage} on {primary} exceeded p{HEDGE_PERCENTILE:g} ({hedge_after:.1f}s), hedging with {fallback}")
+            futures[submit_in_context(_hedge_executor, call, fallback)] = fallback
+            hedged = True
+            continue
+
+        for future in done:
+            model = futures.pop(future)
+            try:
+                return future.result()
+            except CircuitOpenError:
+                if hedged or fallback == primary:
+                    if not futures:
+                        raise
+                    continue
+                logger.info(f"{primary} is unavailable, falling back to {fallback} for {stage}")
+                futures[submit_in_context(_hedge_executor, call, fallback)] = fallback
+                hedged = True
+            except Exception:
+                # The other racer may still produce a valid answer
+                if not futures:
+                    raise
+                logger.warning(f"{stage} on {model} failed, waiting for the other request")
+
+def start_call(call, model, started):
+    started.set()
+    return call(model)
+
+def run_routed(stage, attempt, **retry_options):
+    """Retries `attempt(refresh, model)` under the stage's routing and hedging policy."""
+    return run_with_retries(
+        stage, lambda refresh: hedged_call(stage, lambda model: attempt(refresh, model)), **retry_options
+    )
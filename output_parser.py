@@ -0,0 +1,202 @@
+import ast
+import logging
+import re
+import threading
+
+MAX_TRUNCATION_CUTS = 20
+
+QUOTE_REPLACEMENTS = {
+    "“": '"', "”": '"', "„": '"', "‟": '"',
+    "‘": "'", "’": "'", "‚": "'", "‛": "'"
+}
+SPECIAL_CHARACTERS = {"\u00a0": " ", "\u200b": "", "\ufeff": ""}
+CLOSING_BRACKETS = {"{": "}", "[": "]", "(": ")"}
+OPENING_BRACKETS = {dict: "{", list: "["}
+JSON_LITERALS = {"true": "True", "false": "False", "null": "None"}
+
+logger = logging.getLogger(__name__)
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def parse_output(response, stage, expected=None, required_keys=()):
+    """Parses a Python literal from a model response, repairing it locally before giving up.
+
+    Raises ValueError when the value is not an `expected` instance or lacks any `required_keys`,
+    so a repair that lost part of the output is retried rather than passed on.
+    """
+    text = strip_fences(response)
+
+    try:
+        value = ast.literal_eval(text)
+        outcome = "clean"
+    except (SyntaxError, ValueError):
+        value = repair_literal(text, expected)
+        outcome = "repaired"
+        if value is None:
+            record_outcome(stage, "fallback")
+            raise ValueError(f"Unable to repair {stage} output locally")
+
+    problem = shape_problem(value, expected, required_keys)
+    if problem:
+        record_outcome(stage, "fallback")
+        raise ValueError(f"{stage} output {problem}")
+
+    if outcome == "repaired":
+        logger.info(f"Repaired malformed {stage} output locally")
+    record_outcome(stage, outcome)
+    return value
+
+def shape_problem(value, expected, required_keys):
+    if expected is not None and not isinstance(value, expected):
+        return f"is a {type(value).__name__}, expected a {expected.__name__}"
+    if required_keys:
+        if not isinstance(value, dict):
+            return f"is a {type(value).__name__}, expected a dict"
+        missing = [key for key in required_keys if key not in value]
+        if missing:
+            return f"is missing {', '.join(missing)}"
+    return None
+
+def strip_fences(response):
+    response = response.strip()
+    fenced = re.search(r"```(?:python|json)?\s*(.*?)(?:```|$)", response, flags=re.DOTALL)
+    if fenced:
+        response = fenced.group(1)
+    return response.strip()
+
+def repair_literal(text, expected=None):
+    """Rewrites `text` into a valid literal, returning None when no repair parses."""
+    if expected in OPENING_BRACKETS:
+        start = text.find(OPENING_BRACKETS[expected])
+    else:
+        start = min((idx for idx in (text.find("{"), text.find("[")) if idx != -1), default=-1)
+    if start == -1:
+        return None
+
+    repaired, stack, cuts, truncated = scan_literal(text[start:])
+    if not truncated:
+        try:
+            return ast.literal_eval(repaired + close_brackets(stack))
+        except (SyntaxError, ValueError):
+            pass
+
+    # Drop the truncated final element by cutting back to the last complete one; cuts only
+    # exist after a complete element, so a repair never empties a container
+    for cut, cut_stack in reversed(cuts[-MAX_TRUNCATION_CUTS:]):
+        candidate = re.sub(r",\s*$", "", repaired[:cut])
+        try:
+            return ast.literal_eval(candidate + close_brackets(cut_stack))
+        except (SyntaxError, ValueError):
+            continue
+    return None
+
+def scan_literal(text):
+    """Normalizes quotes and whitespace, drops trailing commas and stray prose, and records cut points."""
+    out = []
+    stack = []
+    cuts = []
+    quote = None
+    curly_quote = False
+    idx = 0
+
+    while idx < len(text):
+        raw = text[idx]
+        char = SPECIAL_CHARACTERS.get(raw, QUOTE_REPLACEMENTS.get(raw, raw))
+
+        if quote is not None:
+            if raw == "\\" and idx + 1 < len(text):
+                out.append(text[idx:idx + 2])
+                idx += 2
+                continue
+            if char == "\n":
+                char = "\\n"
+            elif char == quote and (raw == quote or curly_quote) and not text[idx + 1:idx + 2].isalnum():
+                quote = None
+            elif char == quote:
+                # Quotes of the delimiting kind inside a string are content, as is an apostrophe:
+                # a closing quote is never directly followed by a letter or digit
+                char = "\\" + char
+            out.append(char)
+            idx += 1
+            continue
+
+        if char in ('"', "'"):
+            quote = char
+            curly_quote = raw != char
+        elif char in CLOSING_BRACKETS:
+            stack.append(char)
+        elif char in ("}", "]", ")"):
+            while out and out[-1].strip() in ("", ","):
+                if out.pop() == ",":
+                    break
+            if stack:
+                stack.pop()
+            out.append(char)
+            idx += 1
+            if not stack:
+                # Anything after the outermost literal is stray prose
+                break
+            continue
+        elif char == ",":
+            cuts.append((len(out), list(stack)))
+        elif char.isalpha():
+            word = re.match(r"\w+", text[idx:]).group(0)
+            out.append(JSON_LITERALS.get(word, word))
+            idx += len(word)
+            continue
+
+        out.append(char)
+        idx += 1
+
+    offsets = [0]
+    for piece in out:
+        offsets.append(offsets[-1] + len(piece))
+    cuts = [(offsets[cut], cut_stack) for cut, cut_stack in cuts]
+    return "".join(out), stack, cuts, quote is not None
+
+def close_brackets(stack):
+    return "".join(CLOSING_BRACKETS[bracket] for bracket in reversed(stack))
+
+def record_outcome(stage, outcome):
+    with _stats_lock:
+        stage_stats = _stats.setdefault(stage, {"clean": 0, "repaired": 0, "fallback": 0})
+        stage_stats[outcome] += 1
+
+def parse_stats():
+    with _stats_lock:
+        return {stage: dict(stats) for stage, stats in _stats.items()}
+
+# Testing-------------------------------------------------------
+if __name__ == "__main__":
+    extraction_keys = ("title", "key_facts", "key_entities", "additional_queries")
+
+    assert parse_output("{'a': 'don't'}", "test") == {"a": "don't"}
+    assert parse_output("Based on [1], the answer: {\"a\": 1}", "test", expected=dict) == {"a": 1}
+    assert parse_output("```python\n{'a': [1, 2,], 'b': true}\n```", "test") == {"a": [1, 2], "b": True}
+    assert parse_output("[\"first\", \"second\", \"thi", "test", expected=list) == ["first", "second"]
+
+    extracted = parse_output(
+        "{'title': 'Solar imports rise', "
+        "'key_facts': {'statistical': ['Singapore's largest import deal is 2 GW'], 'non_statistical': []}, "
+        "'key_entities': ['Singapore'], 'additional_queries': ['How does Batam compare?']}",
+        "test", expected=dict, required_keys=extraction_keys
+    )
+    assert extracted["key_facts"]["statistical"] == ["Singapore's largest import deal is 2 GW"]
+    assert extracted["additional_queries"] == ["How does Batam compare?"]
+
+    for malformed, options in [
+        ("{\"a\": \"he said \"hi\"\"}", {}),
+        ("{\"facts\": [\"unfinish", {}),
+        ("[\"a list\", \"not a dict\"]", {"expected": dict}),
+        ("{'title': 'Solar', 'key_facts': {'statistical': [], 'non_statistical': []}, 'key_ent", {"required_keys": extraction_keys}),
+        ("no literal here", {})
+    ]:
+        try:
+            value = parse_output(malformed, "test", **options)
+        except ValueError as e:
+            print(f"Rejected {malformed!r}: {e}")
+        else:
+            raise AssertionError(f"{malformed!r} parsed as {value!r}")
+
+    print(parse_stats())
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from token_ledger import submit_in_context
+import logging
+
+MAX_STAGE_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    """A pipeline step computing `outputs` from the results named in `deps`.
+
+    `cleanup`, if given, is called with the outputs when a later stage fails and the run is abandoned.
+    """
+
+    def __init__(self, name, func, deps=(), outputs=None, description=None, cleanup=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.outputs = tuple(outputs) if outputs else (name,)
+        self.description = description
+        self.cleanup = cleanup
+
+    def is_done(self, results):
+        return all(output in results for output in self.outputs)
+
+    def store(self, results, value):
+        if len(self.outputs) == 1:
+            results[self.outputs[0]] = value
+        else:
+            results.update(zip(self.outputs, value))
+
+def run_stages(stages, results, max_workers=MAX_STAGE_WORKERS):
+    """Runs every stage whose outputs are missing, concurrently where dependencies allow."""
+    results = dict(results)
+    pending = [stage for stage in stages if not stage.is_done(results)]
+    running = {}
+    completed = []
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                for stage in [s for s in pending if all(dep in results for dep in s.deps)]:
+                    pending.remove(stage)
+                    if stage.description:
+                        logger.info(stage.description)
+                    future = submit_in_context(executor, stage.func, *(results[dep] for dep in stage.deps))
+                    running[future] = stage
+
+                if not running:
+                    raise ValueError(f"Unsatisfied stage dependencies: {[stage.name for stage in pending]}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    stage.store(results, future.result())
+                    completed.append(stage)
+    except BaseException:
+        # Leaving the executor waited for the stages still running; nothing downstream will consume them now
+        for future, stage in running.items():
+            if not future.cancelled() and future.exception() is None:
+                stage.store(results, future.result())
+                completed.append(stage)
+        for stage in completed:
+            if stage.cleanup is not None:
+                stage.cleanup(*(results[output] for output in stage.outputs))
+        raise
+
+    return results
+
+def dependents(stages, names):
+    """Returns the outputs of every stage downstream of `names`."""
+    stale = set(names)
+    downstream = set()
+
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            if any(dep in stale for dep in stage.deps) and not stale.issuperset(stage.outputs):
+                stale.update(stage.outputs)
+                downstream.update(stage.outputs)
+                changed = True
+
+    return downstream
+
+def invalidate(stages, results, names):
+    """Drops `names`, their sibling outputs and everything downstream so they are recomputed."""
+    stale = set(names)
+    for stage in stages:
+        if stale.intersection(stage.outputs):
+            stale.update(stage.outputs)
+    stale.update(dependents(stages, stale))
+
+    return {key: value for key, value in results.items() if key not in stale}
@@ -0,0 +1,197 @@
+from dotenv import load_dotenv
+import copy
+import hashlib
+import logging
+import os
+import re
+import string
+import threading
+
+load_dotenv()
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "o200k_base")
+
+# Maximum tokens of the formatted user prompt per stage
+STAGE_BUDGETS = {
+    "extract_info": 24000,
+    "search_facts": 2000,
+    "refine_facts": 12000,
+    "graph_data": 4000,
+    "color_scheme": 6000,
+    "figure": 4000,
+    "graph_layout": 6000,
+    "layout": 12000,
+    "polish_layout": 16000
+}
+
+# Literal text allowed after a template's first field; enough for field labels, not instructions
+MAX_PAYLOAD_LITERAL = 300
+
+logger = logging.getLogger(__name__)
+
+_static_prefixes = {}
+_system_digests = {}
+_prefix_lock = threading.Lock()
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding(PROMPT_ENCODING)
+except Exception:
+    # tiktoken may be missing or unable to fetch its BPE files on air-gapped hosts
+    _encoding = None
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def build_prompt(stage, template, fields, strategies=None):
+    """Formats `template`, shrinking the fields named in `strategies` until it fits the stage budget."""
+    register_prefix(stage, template)
+    budget = STAGE_BUDGETS.get(stage)
+    strategies = strategies or {}
+    fields = dict(fields)
+
+    # HTML is compacted but never cut since the markup must survive intact
+    for name, strategy in strategies.items():
+        if strategy == "html":
+            fields[name] = compact_html(fields[name])
+
+    prompt = template.format(**fields)
+    if budget is None or count_tokens(prompt) <= budget:
+        return prompt
+
+    original_tokens = count_tokens(prompt)
+    for name, strategy in strategies.items():
+        shrink = SHRINK_STRATEGIES.get(strategy)
+        if shrink is None:
+            continue
+
+        while count_tokens(prompt) > budget:
+            shrunk = shrink(fields[name])
+            if shrunk is None:
+                break
+            fields[name] = shrunk
+            prompt = template.format(**fields)
+
+        if count_tokens(prompt) <= budget:
+            break
+
+    logger.warning(f"Truncated {stage} prompt from {original_tokens} to {count_tokens(prompt)} tokens (budget {budget})")
+    return prompt
+
+def split_template(template):
+    """Returns the static text before a template's first field and the literal text that follows it."""
+    prefix = []
+    trailing = []
+    seen_field = False
+    for literal, field, _, _ in string.Formatter().parse(template):
+        (trailing if seen_field else prefix).append(literal)
+        seen_field = seen_field or field is not None
+    return "".join(prefix), "".join(trailing)
+
+def register_prefix(stage, template):
+    """Records the static prefix of a stage's template, warning when instructions follow its dynamic fields."""
+    with _prefix_lock:
+        templates = _static_prefixes.setdefault(stage, {})
+        if template in templates:
+            return
+        prefix, trailing = split_template(template)
+        templates[template] = prefix
+
+    if len(trailing.strip()) > MAX_PAYLOAD_LITERAL:
+        logger.warning(f"{stage} prompt has {len(trailing.strip())} characters of instructions after its dynamic fields")
+
+def check_prefix_stability(stage, messages):
+    """Warns when a stage's system prompt changes or its user prompt strays from its static prefix."""
+    system = "".join(m["content"] for m in messages if m["role"] == "system")
+    digest = hashlib.sha256(system.encode("utf-8")).hexdigest()
+
+    user = next((m["content"] for m in messages if m["role"] == "user"), "")
+    if isinstance(user, list):
+        user = next((part["text"] for part in user if part["type"] == "text"), "")
+
+    with _prefix_lock:
+        previous = _system_digests.setdefault(stage, digest)
+        prefixes = list(_static_prefixes.get(stage, {}).values())
+
+    if previous != digest:
+        logger.warning(f"System prompt of {stage} changed between calls; provider prefix caching will miss")
+    if prefixes and not any(user.startswith(prefix) for prefix in prefixes):
+        logger.warning(f"User prompt of {stage} does not start with its static prefix")
+
+def shrink_list(values):
+    if not values:
+        return None
+    return values[:len(values) * 3 // 4]
+
+def shrink_text(text):
+    if len(text) < 200:
+        return None
+
+    cut = text[:len(text) * 3 // 4]
+    boundary = max(cut.rfind("\n"), cut.rfind(". "))
+    return cut[:boundary + 1] if boundary > len(cut) // 2 else cut
+
+def shrink_dict(value):
+    value = copy.deepcopy(value)
+    longest = find_longest_list(value)
+    if longest is None or len(longest) <= 1:
+        return None
+
+    del longest[(len(longest) + 1) // 2:]
+    return value
+
+def find_longest_list(value):
+    candidates = []
+    if isinstance(value, list):
+        candidates.append(value)
+        children = value
+    elif isinstance(value, dict):
+        children = value.values()
+    else:
+        return None
+
+    for child in children:
+        nested = find_longest_list(child)
+        if nested is not None:
+            candidates.append(nested)
+
+    return max(candidates, key=len, default=None)
+
+def chunk_text(text, max_tokens):
+    """Splits `text` into paragraph-aligned chunks of at most `max_tokens`, breaking long paragraphs by sentence."""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n|\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(re.split(r"(?<=[.!?])\s+", paragraph))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += piece_tokens
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def compact_html(html_code):
+    html_code = re.sub(r"<!--.*?-->", "", html_code, flags=re.DOTALL)
+    return re.sub(r"\n\s*\n+", "\n", html_code).strip()
+
+SHRINK_STRATEGIES = {
+    "list": shrink_list,
+    "text": shrink_text,
+    "dict": shrink_dict
+}
@@ -0,0 +1,91 @@
+import re
+
+FRONTIER_CAPACITY = 20
+DUPLICATE_SIMILARITY = 0.6
+FACT_COVERAGE_WEIGHT = 0.5
+SHINGLE_SIZE = 2
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has", "have",
+    "how", "in", "is", "it", "its", "of", "on", "or", "than", "that", "the", "their", "this", "to",
+    "what", "when", "where", "which", "who", "why", "will", "with"
+}
+
+def tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+def normalize_query(query):
+    return " ".join(tokenize(query))
+
+def shingles(tokens, size=SHINGLE_SIZE):
+    if len(tokens) < size:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class QueryFrontier:
+    """Bounded pool of pending queries, popped in order of novelty."""
+
+    def __init__(self, queries=(), capacity=FRONTIER_CAPACITY):
+        self.capacity = capacity
+        self._pending = {}
+        self._issued = []
+        self._fact_vocab = set()
+        self.rejected = 0
+        self.extend(queries)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __bool__(self):
+        return bool(self._pending)
+
+    def add(self, query):
+        normalized = normalize_query(query)
+        if not normalized or normalized in self._pending:
+            self.rejected += 1
+            return False
+
+        query_shingles = shingles(normalized.split())
+        known = [s for _, s in self._pending.values()] + self._issued
+        if any(jaccard(query_shingles, other) >= DUPLICATE_SIMILARITY for other in known):
+            self.rejected += 1
+            return False
+
+        self._pending[normalized] = (query, query_shingles)
+        if len(self._pending) > self.capacity:
+            least_novel = min(self._pending, key=self._novelty)
+            del self._pending[least_novel]
+            self.rejected += 1
+        return True
+
+    def extend(self, queries):
+        for query in queries:
+            self.add(query)
+
+    def pop(self):
+        normalized = max(self._pending, key=self._novelty)
+        query, query_shingles = self._pending.pop(normalized)
+        self._issued.append(query_shingles)
+        return query
+
+    def mark_issued(self, queries):
+        """Treats `queries` as already searched so near-duplicates of them are rejected."""
+        for query in queries:
+            self._issued.append(shingles(tokenize(query)))
+
+    def add_facts(self, facts):
+        for fact in facts:
+            self._fact_vocab.update(tokenize(str(fact)))
+
+    def _novelty(self, normalized):
+        tokens = set(normalized.split())
+        _, query_shingles = self._pending[normalized]
+
+        issued_similarity = max((jaccard(query_shingles, issued) for issued in self._issued), default=0.0)
+        fact_coverage = len(tokens & self._fact_vocab) / len(tokens)
+        return (1 - issued_similarity) * (1 - FACT_COVERAGE_WEIGHT * fact_coverage)
@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import logging
+import os
+import threading
+import time
+
+load_dotenv()
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", 4))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+
+# Requests and tokens per minute for each model; set these to the account's tier limits
+MODEL_RATE_LIMITS = {
+    "gpt-4o": (5000, 800000),
+    "gpt-4o-mini": (5000, 4000000),
+    "gpt-4.5-preview": (1000, 125000),
+    "o3-mini": (5000, 4000000),
+    "sonar-pro": (50, 1000000)
+}
+DEFAULT_RATE_LIMIT = (500, 200000)
+
+DECREASE_FACTOR = 0.5
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Refills `rate_per_minute` units continuously; takes may overdraw to settle actual usage."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._available >= amount:
+                    self._available -= amount
+                    return
+                wait = (amount - self._available) / self.rate
+            time.sleep(wait)
+
+    def charge(self, amount):
+        with self._lock:
+            self._refill()
+            self._available = min(self.capacity, self._available - amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+        self._updated = now
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: grows by one per window of successes, halves on rate limits and timeouts.
+
+    Latency alone is not treated as congestion, since one model serves stages with very different output lengths.
+    """
+
+    def __init__(self, name, initial=LLM_INITIAL_CONCURRENCY, maximum=LLM_MAX_CONCURRENCY):
+        self.name = name
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, succeeded=False, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+
+            if throttled:
+                self._decrease("rate limited or timed out")
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+    def _decrease(self, reason):
+        limit = max(1.0, self.limit * DECREASE_FACTOR)
+        if int(limit) < int(self.limit):
+            logger.info(f"Reducing {self.name} concurrency to {int(limit)} ({reason})")
+        self.limit = limit
+
+class ModelThrottle:
+    """Request and token buckets plus an adaptive concurrency limit for one model."""
+
+    def __init__(self, model):
+        requests_per_minute, tokens_per_minute = MODEL_RATE_LIMITS.get(model, DEFAULT_RATE_LIMIT)
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limiter = AdaptiveLimiter(model)
+
+    @contextmanager
+    def slot(self, estimated_tokens):
+        self.requests.take(1)
+        self.tokens.take(estimated_tokens)
+        self.limiter.acquire()
+
+        outcome = {"succeeded": False, "throttled": False}
+        try:
+            yield outcome
+        finally:
+            self.limiter.release(outcome["succeeded"], outcome["throttled"])
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+def get_model_throttle(model):
+    with _throttles_lock:
+        if model not in _throttles:
+            _throttles[model] = ModelThrottle(model)
+        return _throttles[model]
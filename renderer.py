@@ -1,15 +1,23 @@
+from asset_bundle import localize_html
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 from io import BytesIO
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from PIL import Image
+import atexit
 import base64
+import logging
+import math
 import os
+import queue
+import threading
 
 load_dotenv()
 CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH")
@@ -17,42 +25,290 @@ CAPTURE_WIDTH = 3000
 CAPTURE_HEIGHT = 3000
 DEVICE_SCALE_FACTOR = 3
 
-def render(html_path):
+RENDER_TIERS = {
+    "draft": 1,
+    "final": DEVICE_SCALE_FACTOR
+}
+
+RENDER_POOL_SIZE = int(os.getenv("RENDER_POOL_SIZE", 2))
+RENDER_MAX_USES = int(os.getenv("RENDER_MAX_USES", 25))
+RENDER_CHECKOUT_TIMEOUT = 120
+RENDER_OFFLINE = os.getenv("RENDER_OFFLINE", "false").lower() == "true"
+RENDER_TILE_PIXEL_BUDGET = int(os.getenv("RENDER_TILE_PIXEL_BUDGET", 16_000_000))
+
+BLOCKED_URL_PATTERNS = ["http://*", "https://*", "ws://*", "wss://*"]
+
+PAGE_READY_SCRIPT = """
+const done = arguments[arguments.length - 1];
+document.fonts.ready.then(() => done(document.readyState));
+"""
+
+CONTAINER_RECT_SCRIPT = """
+const container = document.querySelector("div.infographic-container");
+if (!container) {
+    return null;
+}
+const rect = container.getBoundingClientRect();
+return {
+    x: rect.left + window.scrollX,
+    y: rect.top + window.scrollY,
+    width: rect.width,
+    height: rect.height
+};
+"""
+
+GEOMETRY_SCRIPT = """
+const container = document.querySelector("div.infographic-container");
+const origin = container.getBoundingClientRect();
+const blockDisplays = ["block", "flex", "grid", "list-item", "table-cell", "flow-root"];
+const elements = [];
+const textBlocks = new Set();
+
+const isVisible = (el, rect) => {
+    const style = getComputedStyle(el);
+    return rect.width > 0 && rect.height > 0
+        && style.visibility !== "hidden" && style.display !== "none" && parseFloat(style.opacity) > 0;
+};
+
+const hasOwnText = (el) => Array.from(el.childNodes).some(
+    (node) => node.nodeType === Node.TEXT_NODE && node.textContent.trim()
+);
+
+const insideTextBlock = (el) => {
+    for (let parent = el.parentElement; parent && parent !== container; parent = parent.parentElement) {
+        if (textBlocks.has(parent)) {
+            return true;
+        }
+    }
+    return false;
+};
+
+for (const el of container.querySelectorAll("*")) {
+    const rect = el.getBoundingClientRect();
+    if (!isVisible(el, rect)) {
+        continue;
+    }
+
+    const tag = el.tagName.toLowerCase();
+    const style = getComputedStyle(el);
+    let type = null;
+    if (tag === "img") {
+        const name = (el.getAttribute("src") || "").split("/").pop();
+        type = name.startsWith("graph") ? "graph" : "figure";
+    } else if (/^h[1-6]$/.test(tag) && !insideTextBlock(el)) {
+        type = "heading";
+    } else if (blockDisplays.includes(style.display) && hasOwnText(el) && !insideTextBlock(el)) {
+        type = "text";
+    }
+
+    if (type === null) {
+        continue;
+    }
+    if (type === "heading" || type === "text") {
+        textBlocks.add(el);
+    }
+
+    elements.push({
+        type: type,
+        tag: tag,
+        x: rect.left - origin.left,
+        y: rect.top - origin.top,
+        width: rect.width,
+        height: rect.height,
+        font_size: parseFloat(style.fontSize),
+        src: tag === "img" ? el.getAttribute("src") : null
+    });
+}
+
+return {
+    width: origin.width,
+    height: origin.height,
+    elements: elements
+};
+"""
+
+logger = logging.getLogger(__name__)
+
+def create_driver():
     chrome_options = Options()
     chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--disable-gpu")
 
     service = Service(CHROMEDRIVER_PATH)
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-
-    driver.get(html_path)
-    driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
-        "mobile": False,
-        "width": CAPTURE_WIDTH,
-        "height": CAPTURE_HEIGHT,
-        "deviceScaleFactor": DEVICE_SCALE_FACTOR
-    })
+    return webdriver.Chrome(service=service, options=chrome_options)
+
+class BrowserPool:
+    """Keeps up to `size` warm Chrome instances shared across render threads."""
+
+    def __init__(self, size=RENDER_POOL_SIZE, max_uses=RENDER_MAX_USES):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._uses = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, timeout=RENDER_CHECKOUT_TIMEOUT):
+        if self._closed:
+            raise RuntimeError("Browser pool has been closed")
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No browser available after {timeout}s")
+
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._spawn()
 
-    WebDriverWait(driver, 20).until(
-        EC.presence_of_element_located((By.CSS_SELECTOR, "div.infographic-container"))
-    )
+                if self._is_healthy(driver):
+                    return driver
+                logger.warning("Discarding unresponsive browser instance")
+                self._discard(driver)
+        except Exception:
+            self._slots.release()
+            raise
 
-    element = driver.find_element(By.CSS_SELECTOR, "div.infographic-container")
-    location = element.location_once_scrolled_into_view
-    size = element.size
+    def release(self, driver, healthy=True):
+        try:
+            with self._lock:
+                self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+                uses = self._uses[id(driver)]
 
-    screenshot_data = driver.get_screenshot_as_base64()
-    driver.quit()
+            if not healthy or self._closed or uses >= self.max_uses:
+                if healthy and uses >= self.max_uses:
+                    logger.info(f"Recycling browser instance after {uses} renders")
+                self._discard(driver)
+                return
 
-    full_img = Image.open(BytesIO(base64.b64decode(screenshot_data)))
+            try:
+                driver.get("about:blank")
+            except WebDriverException:
+                self._discard(driver)
+                return
+            self._idle.put(driver)
+        finally:
+            self._slots.release()
 
-    left = int(location["x"] * DEVICE_SCALE_FACTOR)
-    top = int(location["y"] * DEVICE_SCALE_FACTOR)
-    right = int((location["x"] + size["width"]) * DEVICE_SCALE_FACTOR)
-    bottom = int((location["y"] + size["height"]) * DEVICE_SCALE_FACTOR)
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        healthy = True
+        try:
+            yield driver
+        except Exception:
+            healthy = self._is_healthy(driver)
+            raise
+        finally:
+            self.release(driver, healthy)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+    def _spawn(self):
+        driver = create_driver()
+        with self._lock:
+            self._uses[id(driver)] = 0
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Error shutting down browser instance: {e}")
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            return driver.execute_script("return 1;") == 1
+        except WebDriverException:
+            return False
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+            atexit.register(_pool.close)
+        return _pool
+
+def render(html_path, tier="final", offline=RENDER_OFFLINE, with_geometry=False):
+    scale_factor = RENDER_TIERS[tier]
+
+    with get_browser_pool().driver() as driver:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {
+            "urls": BLOCKED_URL_PATTERNS if offline else []
+        })
+
+        if offline:
+            driver.get(localize_html(html_path))
+            driver.execute_async_script(PAGE_READY_SCRIPT)
+        else:
+            driver.get(html_path)
+
+        driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
+            "mobile": False,
+            "width": CAPTURE_WIDTH,
+            "height": CAPTURE_HEIGHT,
+            "deviceScaleFactor": scale_factor
+        })
+
+        if not offline:
+            WebDriverWait(driver, 20).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "div.infographic-container"))
+            )
+
+        rect = driver.execute_script(CONTAINER_RECT_SCRIPT)
+        if rect is None:
+            raise ValueError(f"No infographic container found in {html_path}")
+        img = capture_clip(driver, rect, scale_factor)
+
+        if with_geometry:
+            return img, driver.execute_script(GEOMETRY_SCRIPT)
+        return img
+
+def capture_clip(driver, rect, scale_factor):
+    x, y = rect["x"], rect["y"]
+    width = math.ceil(rect["width"])
+    height = math.ceil(rect["height"])
+
+    tile_height = max(1, RENDER_TILE_PIXEL_BUDGET // max(1, int(width * scale_factor ** 2)))
+    if tile_height >= height:
+        return capture_region(driver, x, y, width, height)
+
+    stitched = None
+    for offset in range(0, height, tile_height):
+        tile = capture_region(driver, x, y + offset, width, min(tile_height, height - offset))
+        if stitched is None:
+            stitched = Image.new(tile.mode, (tile.width, round(height * scale_factor)))
+        stitched.paste(tile, (0, round(offset * scale_factor)))
+        tile.close()
+
+    return stitched
+
+def capture_region(driver, x, y, width, height):
+    screenshot = driver.execute_cdp_cmd("Page.captureScreenshot", {
+        "format": "png",
+        "captureBeyondViewport": True,
+        "clip": {"x": x, "y": y, "width": width, "height": height, "scale": 1}
+    })
 
-    cropped = full_img.crop((left, top, right, bottom))
-    return cropped
+    img = Image.open(BytesIO(base64.b64decode(screenshot["data"])))
+    img.load()
+    return img
 
 # Testing-------------------------------------------------------
 if __name__ == "__main__":
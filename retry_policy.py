@@ -0,0 +1,147 @@
+from dotenv import load_dotenv
+import logging
+import openai
+import os
+import random
+import threading
+import time
+
+load_dotenv()
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 4))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 1.0))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 30.0))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 60.0))
+
+# Wall-clock budget in seconds for all attempts of a stage, including backoff
+DEFAULT_STAGE_DEADLINE = 180.0
+STAGE_DEADLINES = {
+    "extract_info": 240.0,
+    "search": 90.0,
+    "search_facts": 120.0,
+    "refine_facts": 300.0,
+    "figure": 300.0,
+    "layout": 300.0,
+    "polish_layout": 300.0
+}
+
+# Provider-side failures worth retrying; anything else from the SDK is a bug in the request
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError
+)
+
+logger = logging.getLogger(__name__)
+
+class StageFailedError(Exception):
+    """Raised when a stage gives up after exhausting its attempts or deadline."""
+
+    def __init__(self, stage, reason):
+        super().__init__(f"{stage} failed: {reason}")
+        self.stage = stage
+
+class CircuitOpenError(StageFailedError):
+    """Raised without calling the provider while an endpoint's circuit is open."""
+
+class CircuitBreaker:
+    """Stops calls to an endpoint after repeated transient failures until a cool-down passes."""
+
+    def __init__(self, endpoint, threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self, stage):
+        """Raises CircuitOpenError while open; returns True when this call is the half-open probe."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+
+            # After the cool-down a single probe is let through; everyone else keeps failing fast
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpenError(stage, f"circuit open for {self.endpoint}")
+            self._probing = True
+            return True
+
+    def end_probe(self):
+        """Re-opens the circuit if a probe ended without recording an outcome, so a later one can run."""
+        with self._lock:
+            if self._probing:
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Opening circuit for {self.endpoint} after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(endpoint):
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+        return _breakers[endpoint]
+
+def backoff_delay(attempt, error=None):
+    """Full-jitter exponential backoff, honouring a provider's Retry-After when it sends one."""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), RETRY_MAX_DELAY))
+        except ValueError:
+            pass
+    return delay
+
+def run_with_retries(stage, attempt, retry_on=(SyntaxError, ValueError), max_attempts=RETRY_MAX_ATTEMPTS):
+    """Calls `attempt(refresh)` until it returns, backing off between failures.
+
+    `refresh` is True on every call after the first so a cached bad response is not replayed.
+    """
+    deadline = time.monotonic() + STAGE_DEADLINES.get(stage, DEFAULT_STAGE_DEADLINE)
+
+    for attempt_idx in range(max_attempts):
+        try:
+            return attempt(attempt_idx > 0)
+        except StageFailedError:
+            raise
+        except TRANSIENT_ERRORS as e:
+            error = e
+            logger.warning(f"Transient error in {stage}: {e}")
+        except openai.OpenAIError:
+            raise
+        except retry_on as e:
+            error = e
+            logger.warning(f"Encountered error in {stage}: {e}")
+
+        if attempt_idx + 1 == max_attempts:
+            break
+
+        delay = backoff_delay(attempt_idx, error)
+        if time.monotonic() + delay > deadline:
+            raise StageFailedError(stage, f"deadline exceeded after {attempt_idx + 1} attempts") from error
+
+        logger.info(f"Retrying {stage} in {delay:.1f}s...")
+        time.sleep(delay)
+
+    raise StageFailedError(stage, f"gave up after {max_attempts} attempts") from error
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+import contextvars
+import json
+import threading
+import time
+
+_current_ledger = contextvars.ContextVar("token_ledger", default=None)
+
+class TokenLedger:
+    """Per-session record of prompt and completion tokens for every LLM call."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, model, prompt_tokens, completion_tokens, latency, cached=False):
+        with self._lock:
+            self.records.append({
+                "stage": stage,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "latency": round(latency, 3),
+                "cached": cached
+            })
+
+    def summary(self):
+        stages = {}
+        with self._lock:
+            for record in self.records:
+                totals = stages.setdefault(record["stage"], {
+                    "calls": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0
+                })
+                totals["calls"] += 1
+                totals["cached"] += int(record["cached"])
+                totals["latency"] = round(totals["latency"] + record["latency"], 3)
+                if not record["cached"]:
+                    totals["prompt_tokens"] += record["prompt_tokens"]
+                    totals["completion_tokens"] += record["completion_tokens"]
+        return stages
+
+    def save(self, out_path):
+        with out_path.open("w") as f:
+            json.dump({"summary": self.summary(), "calls": self.records}, f, indent=2)
+
+@contextmanager
+def ledger_session():
+    ledger = TokenLedger()
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+def current_ledger():
+    return _current_ledger.get()
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """Submits `fn` so it runs with the caller's context, keeping the session ledger visible."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -3,9 +3,12 @@ from PIL import Image
 import base64
 import io
 import json
+import logging
 
 TARGET_SCORE = 21
 
+logger = logging.getLogger(__name__)
+
 def reset_feedback(user_feedback):
     user_feedback.clear()
     user_feedback.update({
@@ -45,13 +48,28 @@ def report_evaluation(evaluation, target_score):
 
     return "\n".join(output), suggestions
 
-def encode_img(img):
+def encode_img(img, max_edge=None, img_format="PNG", quality=None, grayscale=False):
+    img_format = img_format.upper()
+
+    if max_edge and max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    if grayscale:
+        img = img.convert("L")
+    elif img_format == "JPEG" and img.mode != "RGB":
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A") if "A" in img.getbands() else None)
+        img = background
+
+    save_params = {"quality": quality} if quality and img_format in ("JPEG", "WEBP") else {}
+
     img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
+    img.save(img_bytes, format=img_format, **save_params)
     img_bytes = img_bytes.getvalue()
 
     utf8_img = base64.b64encode(img_bytes).decode("utf-8")
-    return f"data:image/png;base64,{utf8_img}"
+    return f"data:image/{img_format.lower()};base64,{utf8_img}"
 
 def get_eval_score(evaluation):
     return sum(metric.get("score", 0) for metric in evaluation.values() if isinstance(metric, dict))
@@ -85,8 +103,16 @@ def save_infographic(info_img, info_metadata, out_dir):
     with out_file.open('w') as f:
         json.dump(info_metadata, f, indent=2)
 
-def save_html(html_code, out_dir):
-    h_name = "layout.html"
+def save_ledger(ledger, out_dir):
+    ledger.save(out_dir / "token_ledger.json")
+
+    for stage, totals in ledger.summary().items():
+        logger.info(
+            f"{stage}: {totals['calls']} calls ({totals['cached']} cached), "
+            f"{totals['prompt_tokens']} prompt / {totals['completion_tokens']} completion tokens"
+        )
+
+def save_html(html_code, out_dir, h_name="layout.html"):
     out_path = out_dir / h_name
     with out_path.open("w") as f:
         f.write(html_code)